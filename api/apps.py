@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .http_client import install_dns_cache
+
+        # Cover yt-dlp's in-process lookups too, not only calls made through the shared client
+        install_dns_cache()
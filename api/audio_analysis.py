@@ -0,0 +1,162 @@
+import math
+import subprocess
+
+import numpy as np
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+# ITU-R BS.1770 K-weighting at 48 kHz: high-shelf pre-filter followed by the RLB high-pass
+K_WEIGHTING_STAGES = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)),
+)
+
+# ReplayGain 2.0 reference loudness
+REPLAYGAIN_REFERENCE_LUFS = -18.0
+
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+ANALYZER_VERSION = 1
+
+
+class AnalysisError(Exception):
+    pass
+
+
+def k_weighting_power(block_size):
+    """
+    |H(f)|^2 of the 48 kHz K-weighting filter at the rfft bins of a block
+    One-sided bins are doubled so that summing weighted |X|^2 gives the block energy
+    """
+    z = np.exp(-1j * 2 * np.pi * np.fft.rfftfreq(block_size))
+    response = np.ones_like(z)
+    for b, a in K_WEIGHTING_STAGES:
+        response *= (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    power = np.abs(response) ** 2
+    power[1:(block_size + 1) // 2] *= 2
+    return power
+
+
+class LoudnessAnalyzer:
+    """
+    Streaming EBU R128 / ReplayGain 2.0 analysis of 48 kHz float PCM
+
+    PCM is fed in arbitrary chunks. Each chunk is cut into 100 ms sub-blocks and
+    K-weighted in the frequency domain, all sub-blocks in a single vectorized FFT.
+    The 400 ms gating blocks with 75% overlap are then sliding sums of four sub-blocks.
+    Frequency-domain weighting ignores filter state across block edges, which is
+    well within a tenth of a LU on music.
+    """
+
+    sample_rate = SAMPLE_RATE
+
+    def __init__(self, channels=CHANNELS):
+        self.channels = channels
+        self.sub_block = self.sample_rate // 10
+        self._weights = k_weighting_power(self.sub_block) / self.sub_block ** 2
+        self._remainder = np.empty((0, channels), dtype=np.float32)
+        self._powers = []
+        self.samples = 0
+        self.peak = 0.0
+
+    def feed(self, pcm):
+        """Add a (frames, channels) float32 chunk"""
+        if not len(pcm):
+            return
+        self.samples += len(pcm)
+        self.peak = max(self.peak, float(np.abs(pcm).max()))
+
+        data = np.concatenate((self._remainder, pcm)) if len(self._remainder) else pcm
+        usable = len(data) // self.sub_block * self.sub_block
+        self._remainder = data[usable:].copy()
+        if not usable:
+            return
+
+        blocks = data[:usable].reshape(-1, self.sub_block, self.channels)
+        spectrum = np.fft.rfft(blocks, axis=1)
+        energy = np.einsum('bkc,k->bc', spectrum.real ** 2 + spectrum.imag ** 2, self._weights)
+        self._powers.append(energy)
+
+    def result(self):
+        if self.samples == 0:
+            raise AnalysisError('No audio decoded')
+
+        powers = np.concatenate(self._powers) if self._powers else np.empty((0, self.channels))
+        if len(powers) >= 4:
+            # Mean square per 400 ms gating block, summed over channels (all weights 1 for L/R)
+            cumulative = np.concatenate((np.zeros((1, self.channels)), np.cumsum(powers, axis=0)))
+            blocks = ((cumulative[4:] - cumulative[:-4]) / 4).sum(axis=1)
+        else:
+            # Shorter than one gating block, treat what we have as a single block
+            blocks = powers.mean(axis=0, keepdims=True).sum(axis=1) if len(powers) else np.zeros(1)
+
+        integrated = self._gated_loudness(blocks)
+        peak_dbfs = 20 * math.log10(self.peak) if self.peak > 0 else None
+        return {
+            'integrated_lufs': round(integrated, 2) if integrated is not None else None,
+            'peak': round(self.peak, 6),
+            'peak_dbfs': round(peak_dbfs, 2) if peak_dbfs is not None else None,
+            'duration': round(self.samples / self.sample_rate, 3),
+            'replaygain_track_gain': (
+                round(REPLAYGAIN_REFERENCE_LUFS - integrated, 2) if integrated is not None else None
+            ),
+            'replaygain_track_peak': round(self.peak, 6),
+            'reference_lufs': REPLAYGAIN_REFERENCE_LUFS,
+            'analyzer_version': ANALYZER_VERSION,
+        }
+
+    @staticmethod
+    def _gated_loudness(blocks):
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * np.log10(blocks)
+        above_absolute = loudness > ABSOLUTE_GATE_LUFS
+        if not above_absolute.any():
+            return None
+        relative_gate = -0.691 + 10 * math.log10(blocks[above_absolute].mean()) + RELATIVE_GATE_LU
+        gated = above_absolute & (loudness > relative_gate)
+        return -0.691 + 10 * math.log10(blocks[gated].mean())
+
+
+def iter_pcm(path, sample_rate=SAMPLE_RATE, channels=CHANNELS, chunk_seconds=10):
+    """
+    Decode an audio file with FFmpeg and yield (frames, channels) float32 chunks
+    Only one chunk is held in memory at a time
+    """
+    command = [
+        'ffmpeg', '-nostdin', '-v', 'error', '-i', path,
+        '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(sample_rate), '-',
+    ]
+    frame_bytes = 4 * channels
+    chunk_bytes = sample_rate * chunk_seconds * frame_bytes
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise AnalysisError('ffmpeg not found')
+
+    try:
+        pending = b''
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            data = pending + data
+            usable = len(data) // frame_bytes * frame_bytes
+            pending = data[usable:]
+            yield np.frombuffer(data[:usable], dtype='<f4').reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise AnalysisError(f'ffmpeg decode failed: {stderr.decode("utf-8", "replace").strip()[:200]}')
+
+
+def analyze_file(path):
+    """Loudness, peak and duration of an audio file"""
+    analyzer = LoudnessAnalyzer()
+    for chunk in iter_pcm(path):
+        analyzer.feed(chunk)
+    return analyzer.result()
@@ -0,0 +1,266 @@
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from yt_dlp.utils import DownloadError, ExtractorError, UnsupportedError
+
+# yt-dlp errors that describe the requested content, not the health of YouTube
+_CONTENT_ERROR_RE = re.compile(
+    r'video unavailable|this video is (?:no longer |not )?available|private video|has been removed'
+    r'|terminated|copyright|not available in your country|members-only|confirm your age'
+    r'|live event will begin|premieres in|unsupported url|is not a valid url|incomplete youtube id',
+    re.IGNORECASE,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the breaker is open"""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Upstream '{name}' is unavailable, retry in {retry_after:.0f}s")
+
+
+def is_upstream_failure(error):
+    """
+    Default failure predicate: does this exception say something about the upstream's health?
+    Unavailable, private, removed or unsupported content is the caller's problem and
+    must not open the breaker for everyone else
+    """
+    if isinstance(error, DownloadError) and error.exc_info and error.exc_info[1] is not None:
+        error = error.exc_info[1]
+    if isinstance(error, UnsupportedError):
+        return False
+    if isinstance(error, (DownloadError, ExtractorError)) and _CONTENT_ERROR_RE.search(str(error)):
+        return False
+    return True
+
+
+class LatencyTracker:
+    """
+    Rolling window of observed call latencies
+    Used to derive per-operation deadlines from recent percentiles
+    """
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        """Nearest-rank percentile of the window, None when empty"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker around an upstream operation
+
+    - closed: calls go through, consecutive failures are counted
+    - open: calls are rejected immediately until recovery_timeout elapses
+    - half-open: a limited number of trial calls decide whether to close again
+
+    Only exceptions for which `is_failure(error)` is true count as failures. With
+    `slow_call_is_failure` a call that returns after its deadline counts as one too;
+    turn it off where the deadline only bounds single socket reads, not the whole call.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0,
+                 half_open_max_calls=1, min_timeout=5.0, max_timeout=60.0,
+                 default_timeout=20.0, timeout_percentile=95, timeout_multiplier=3.0,
+                 min_samples=10, slow_call_is_failure=True, is_failure=is_upstream_failure):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.default_timeout = default_timeout
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+        self.slow_call_is_failure = slow_call_is_failure
+        self.is_failure = is_failure
+
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._stats = {'calls': 0, 'successes': 0, 'failures': 0, 'rejected': 0, 'timeouts': 0, 'ignored': 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        # Caller must hold the lock
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def timeout(self):
+        """
+        Deadline for the next call in seconds
+        Derived from the observed latency percentile, clamped to [min_timeout, max_timeout]
+        """
+        if len(self.latency) < self.min_samples:
+            return self.default_timeout
+        observed = self.latency.percentile(self.timeout_percentile)
+        return max(self.min_timeout, min(self.max_timeout, observed * self.timeout_multiplier))
+
+    def retry_after(self):
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self):
+        """Check whether a call may go through right now"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self, elapsed):
+        self.latency.record(elapsed)
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['successes'] += 1
+            self._failures = 0
+            self._state = self.CLOSED
+
+    def record_failure(self, elapsed=None, timed_out=False):
+        if elapsed is not None:
+            self.latency.record(elapsed)
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['failures'] += 1
+            if timed_out:
+                self._stats['timeouts'] += 1
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_ignored(self):
+        """
+        The call failed for a reason that isn't the upstream's fault (e.g. a deleted video)
+        The upstream did answer, so a half-open breaker closes, but no latency is recorded
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['ignored'] += 1
+            if self._state == self.HALF_OPEN:
+                self._failures = 0
+                self._state = self.CLOSED
+
+    def release(self):
+        """
+        Give back a call admitted by allow_request() that ended without an outcome
+        (e.g. the client disconnected); without this a half-open breaker would stay
+        half-open with its trial slot used up
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def call(self, func, *args, is_failure=None, **kwargs):
+        """
+        Run func through the breaker
+        The deadline for this call is passed to func as the `timeout` keyword argument.
+        `is_failure` overrides the breaker's predicate for which exceptions count as failures.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(self.name, self.retry_after())
+
+        is_failure = is_failure or self.is_failure
+        deadline = self.timeout()
+        start = time.monotonic()
+        try:
+            result = func(*args, timeout=deadline, **kwargs)
+        except Exception as e:
+            elapsed = time.monotonic() - start
+            if is_failure(e):
+                self.record_failure(elapsed, timed_out=elapsed >= deadline)
+            else:
+                self.record_ignored()
+            raise
+
+        elapsed = time.monotonic() - start
+        if elapsed > deadline and self.slow_call_is_failure:
+            # The call completed but blew its deadline, treat it as a slow failure
+            self.record_failure(elapsed, timed_out=True)
+        else:
+            self.record_success(elapsed)
+        return result
+
+    def snapshot(self):
+        """Current state and counters for the metrics endpoint"""
+        with self._lock:
+            state = self._current_state()
+            stats = dict(self._stats)
+            failures = self._failures
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            'state': state,
+            'consecutive_failures': failures,
+            'retry_after': round(self.retry_after(), 1),
+            'timeout': round(self.timeout(), 2),
+            'latency_p50': round(p50, 3) if p50 is not None else None,
+            'latency_p95': round(p95, 3) if p95 is not None else None,
+            **stats,
+        }
+
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """
+    Process-wide breaker for an upstream operation
+    Options come from settings.CIRCUIT_BREAKERS['default'] overridden by settings.CIRCUIT_BREAKERS[name]
+    """
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            config = getattr(settings, 'CIRCUIT_BREAKERS', {})
+            options = {**config.get('default', {}), **config.get(name, {})}
+            breaker = CircuitBreaker(name, **options)
+            _breakers[name] = breaker
+        return breaker
+
+
+def breaker_states():
+    """Snapshot of every breaker created so far"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,70 @@
+from django.conf import settings
+
+
+class DownloadProfile:
+    """
+    Tunable yt-dlp download settings shared by every download path
+
+    concurrent_fragments: number of DASH/HLS fragments fetched in parallel
+    http_chunk_size: size of ranged requests for non-fragmented streams (bytes, 0 disables)
+    buffer_size: initial read buffer size (bytes)
+    """
+
+    DEFAULTS = {
+        'concurrent_fragments': 4,
+        'http_chunk_size': 10 * 1024 * 1024,
+        'buffer_size': 64 * 1024,
+        'resize_buffer': True,
+        'audio_codec': 'mp3',
+        'audio_quality': '192',
+    }
+
+    def __init__(self, **options):
+        unknown = set(options) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown download profile option(s): {', '.join(sorted(unknown))}")
+        values = {**self.DEFAULTS, **options}
+        self.concurrent_fragments = max(1, int(values['concurrent_fragments']))
+        self.http_chunk_size = int(values['http_chunk_size'] or 0)
+        self.buffer_size = int(values['buffer_size'])
+        self.resize_buffer = bool(values['resize_buffer'])
+        self.audio_codec = values['audio_codec']
+        self.audio_quality = str(values['audio_quality'])
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        """Profile from settings.DOWNLOAD_PROFILE with optional per-call overrides"""
+        return cls(**{**getattr(settings, 'DOWNLOAD_PROFILE', {}), **overrides})
+
+    def network_opts(self):
+        """yt-dlp options controlling how bytes are fetched"""
+        opts = {
+            'concurrent_fragment_downloads': self.concurrent_fragments,
+            'buffersize': self.buffer_size,
+            'noresizebuffer': not self.resize_buffer,
+        }
+        if self.http_chunk_size:
+            opts['http_chunk_size'] = self.http_chunk_size
+        return opts
+
+    def ydl_opts(self, output_template, extract_audio=True):
+        """Full yt-dlp options for downloading best audio to output_template"""
+        opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': output_template,
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            **self.network_opts(),
+        }
+        if extract_audio:
+            opts['postprocessors'] = [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': self.audio_codec,
+                'preferredquality': self.audio_quality,
+            }]
+        return opts
+
+    def __repr__(self):
+        return (f"DownloadProfile(concurrent_fragments={self.concurrent_fragments}, "
+                f"http_chunk_size={self.http_chunk_size}, buffer_size={self.buffer_size})")
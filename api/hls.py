@@ -0,0 +1,261 @@
+import fcntl
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+import yt_dlp
+from django.conf import settings
+
+from .circuit_breaker import get_breaker, is_upstream_failure
+from .download_profile import DownloadProfile
+from .track_store import get_track_store
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_NAME = 'playlist.m3u8'
+SEGMENT_RE = re.compile(r'^seg_\d{5}\.ts$')
+_LOCK_NAME = '.transcoding'
+_GUARD_NAME = '.transcoding.guard'
+
+_processes = {}
+_processes_lock = threading.Lock()
+
+
+class HLSError(Exception):
+    pass
+
+
+HLS_SUFFIX = '.hls'
+
+
+def hls_dir(video_id):
+    return get_track_store().path(video_id, HLS_SUFFIX)
+
+
+def playlist_path(video_id):
+    return os.path.join(hls_dir(video_id), PLAYLIST_NAME)
+
+
+def is_complete(video_id):
+    """True once FFmpeg has written the final playlist"""
+    try:
+        with open(playlist_path(video_id), 'r', encoding='utf-8') as f:
+            return '#EXT-X-ENDLIST' in f.read()
+    except FileNotFoundError:
+        return False
+
+
+def is_running(video_id):
+    """True while some worker process holds the transcode lock for this track"""
+    with _processes_lock:
+        process = _processes.get(video_id)
+        if process is not None:
+            if process.poll() is None:
+                return True
+            del _processes[video_id]
+
+    # The transcode may have been started by another gunicorn worker
+    return _lock_holder_alive(os.path.join(hls_dir(video_id), _LOCK_NAME))
+
+
+def _lock_holder_alive(lock_path):
+    try:
+        with open(lock_path, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return True
+    except PermissionError:
+        return True
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        return False
+
+
+def _acquire_lock(directory):
+    """
+    Take the transcode lock; True if this process now holds it
+    The lock is created with os.link from a file that already holds our PID, which is
+    as exclusive as O_CREAT|O_EXCL but never leaves an empty lock visible. A lock left
+    behind by a dead process is taken over.
+    """
+    os.makedirs(directory, exist_ok=True)
+    lock_path = os.path.join(directory, _LOCK_NAME)
+    temp_path = f'{lock_path}.{os.getpid()}.{threading.get_ident()}'
+    with open(temp_path, 'w') as f:
+        f.write(str(os.getpid()))
+    try:
+        for _ in range(2):
+            try:
+                os.link(temp_path, lock_path)
+                return True
+            except FileExistsError:
+                if not _remove_stale_lock(directory, lock_path):
+                    return False
+        return False
+    finally:
+        os.remove(temp_path)
+
+
+def _remove_stale_lock(directory, lock_path):
+    """Remove the lock if its holder is dead; serialized so two processes can't both take it over"""
+    with open(os.path.join(directory, _GUARD_NAME), 'a') as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX)
+        if _lock_holder_alive(lock_path):
+            return False
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        return True
+
+
+def _write_lock(directory, pid):
+    """Point the lock at the FFmpeg process (atomic replace, the lock never disappears)"""
+    temp_path = os.path.join(directory, f'{_LOCK_NAME}.{os.getpid()}')
+    with open(temp_path, 'w') as f:
+        f.write(str(pid))
+    os.replace(temp_path, os.path.join(directory, _LOCK_NAME))
+
+
+def _release_lock(directory):
+    try:
+        os.remove(os.path.join(directory, _LOCK_NAME))
+    except FileNotFoundError:
+        pass
+
+
+def ensure_stream(url, video_id):
+    """
+    Start an HLS transcode for the track unless one exists or is already running
+    Returns 'complete', 'running' or 'started'
+    The lock file is taken before anything is touched, so concurrent workers can't both
+    clear the directory and start FFmpeg for the same track.
+    """
+    if is_complete(video_id):
+        return 'complete'
+
+    directory = hls_dir(video_id)
+    if not _acquire_lock(directory):
+        return 'running'
+    try:
+        # Another worker may have finished the transcode just before we took the lock
+        if is_complete(video_id):
+            _release_lock(directory)
+            return 'complete'
+        with span('extraction'):
+            stream = get_breaker('youtube.extract').call(_resolve_stream, url, is_failure=_counts_as_failure)
+        # Anything else in the directory is from an interrupted transcode
+        for name in os.listdir(directory):
+            if not name.startswith(_LOCK_NAME):
+                os.remove(os.path.join(directory, name))
+        process = _start_ffmpeg(stream, directory)
+    except BaseException:
+        _release_lock(directory)
+        raise
+
+    _write_lock(directory, process.pid)
+    # FFmpeg writes segments straight to disk, bypassing the store's write accounting
+    get_track_store().maybe_evict()
+    with _processes_lock:
+        _processes[video_id] = process
+    threading.Thread(target=_reap, args=(video_id, process, directory), daemon=True).start()
+    logger.info('hls transcode started', extra={'video_id': video_id, 'pid': process.pid})
+    return 'started'
+
+
+def _counts_as_failure(error):
+    return not isinstance(error, HLSError) and is_upstream_failure(error)
+
+
+def _resolve_stream(url, timeout=None):
+    """Direct URL and request headers of the best audio format"""
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': timeout,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    stream_url = info.get('url')
+    if not stream_url:
+        raise HLSError('No direct audio stream available for this video')
+    return {'url': stream_url, 'http_headers': info.get('http_headers') or {}}
+
+
+def _start_ffmpeg(stream, directory):
+    segment_seconds = getattr(settings, 'HLS_SEGMENT_SECONDS', 6)
+    profile = DownloadProfile.from_settings()
+    command = ['ffmpeg', '-nostdin', '-v', 'error']
+    if stream['http_headers']:
+        headers = ''.join(f'{key}: {value}\r\n' for key, value in stream['http_headers'].items())
+        command += ['-headers', headers]
+    command += [
+        '-i', stream['url'],
+        '-vn', '-c:a', 'aac', '-b:a', f'{profile.audio_quality}k',
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_list_size', '0',
+        '-hls_playlist_type', 'event',
+        # temp_file: segments and playlist only appear once fully written
+        '-hls_flags', 'independent_segments+temp_file',
+        '-hls_segment_filename', os.path.join(directory, 'seg_%05d.ts'),
+        os.path.join(directory, PLAYLIST_NAME),
+    ]
+    try:
+        return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise HLSError('ffmpeg not found')
+
+
+def _reap(video_id, process, directory):
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        # A partial playlist without #EXT-X-ENDLIST would keep players waiting forever;
+        # dropping it lets the next HLSStartView call start over
+        shutil.rmtree(directory, ignore_errors=True)
+    else:
+        _release_lock(directory)
+    if process.returncode != 0:
+        logger.error('hls transcode failed', extra={
+            'video_id': video_id,
+            'returncode': process.returncode,
+            'stderr': stderr.decode('utf-8', 'replace').strip()[:200],
+        })
+    else:
+        logger.info('hls transcode finished', extra={'video_id': video_id})
+    with _processes_lock:
+        if _processes.get(video_id) is process:
+            del _processes[video_id]
+
+
+def wait_for_playlist(video_id, timeout):
+    """
+    Block until the playlist lists at least one segment
+    Returns the playlist text, or None if nothing showed up in time or the playlist
+    belongs to a transcode that died before finishing
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        playlist = _read_playlist(video_id)
+        if playlist is not None and '#EXTINF' in playlist:
+            if '#EXT-X-ENDLIST' in playlist or is_running(video_id):
+                return playlist
+            # Not running and not finished: either it just finished or it died
+            playlist = _read_playlist(video_id)
+            return playlist if playlist and '#EXT-X-ENDLIST' in playlist else None
+        if time.monotonic() >= deadline or not (is_running(video_id) or is_complete(video_id)):
+            return None
+        time.sleep(0.2)
+
+
+def _read_playlist(video_id):
+    try:
+        with open(playlist_path(video_id), 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
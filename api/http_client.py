@@ -0,0 +1,293 @@
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+)
+
+_client = None
+_client_lock = threading.Lock()
+_dns_cache = None
+_dns_cache_lock = threading.Lock()
+# Per-thread deadline of the request being sent, read by BoundedRetry
+_deadline = threading.local()
+
+
+def http_client_config():
+    config = {
+        'POOL_CONNECTIONS': 16,
+        'POOL_MAXSIZE': 10,
+        # Host suffix -> keep-alive connections kept per host
+        'HOST_POOLS': {},
+        'POOL_BLOCK': False,
+        'RETRIES': 2,
+        'BACKOFF_FACTOR': 0.3,
+        'RETRY_STATUSES': (429, 500, 502, 503, 504),
+        # Longest sleep between attempts, however long a Retry-After the server asks for
+        'RETRY_MAX_SLEEP': 2.0,
+        'DNS_CACHE_TTL': 300,
+        'DNS_CACHE_MAX_ENTRIES': 1024,
+        'HTTP2': False,
+        **getattr(settings, 'HTTP_CLIENT', {}),
+    }
+    config['HOST_POOLS'] = dict(config['HOST_POOLS'])
+    return config
+
+
+class DNSCache:
+    """
+    TTL cache in front of socket.getaddrinfo
+    Installed process-wide, so it also covers the lookups yt-dlp makes in-process.
+    Only successful lookups are cached; failures always go back to the resolver.
+    Holds at most `max_entries` lookups: expired ones are dropped first, then the oldest.
+    """
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._getaddrinfo = socket.getaddrinfo
+
+    def install(self):
+        socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        if socket.getaddrinfo == self.getaddrinfo:
+            socket.getaddrinfo = self._getaddrinfo
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return list(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        result = self._getaddrinfo(host, port, family, type, proto, flags)
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.max_entries:
+                self._drop_expired(now)
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[key] = (now + self.ttl, result)
+        return list(result)
+
+    def _drop_expired(self, now):
+        # Insertion order is expiry order, since every entry gets the same TTL
+        while self._entries:
+            key, (expires, _) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            live = sum(1 for expires, _ in self._entries.values() if expires > now)
+        return {'ttl': self.ttl, 'entries': live, 'hits': self.hits, 'misses': self.misses}
+
+
+@contextmanager
+def request_deadline(seconds):
+    """Bound every retry of the requests sent inside the block to `seconds` from now"""
+    previous = getattr(_deadline, 'at', None)
+    _deadline.at = None if seconds is None else time.monotonic() + seconds
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+def _time_left():
+    deadline = getattr(_deadline, 'at', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class BoundedRetry(Retry):
+    """
+    Retry that never sleeps longer than `max_sleep` between attempts, whatever
+    Retry-After the server sends, and gives up once the request's deadline has passed
+    """
+
+    def __init__(self, *args, max_sleep=2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_sleep = max_sleep
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.max_sleep = self.max_sleep
+        return retry
+
+    def is_exhausted(self):
+        time_left = _time_left()
+        return (time_left is not None and time_left <= 0) or super().is_exhausted()
+
+    def sleep(self, response=None):
+        delay = self.get_backoff_time()
+        if self.respect_retry_after_header and response is not None:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None:
+                delay = retry_after
+        delay = min(delay, self.max_sleep)
+        time_left = _time_left()
+        if time_left is not None:
+            delay = min(delay, time_left)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HostPoolAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose keep-alive pool size depends on the target host
+    `host_pools` maps host suffixes ('googlevideo.com' also matches every
+    rrN---sn-xxx.googlevideo.com edge) to a pool size; other hosts get `pool_maxsize`
+    """
+
+    def __init__(self, host_pools=None, **kwargs):
+        # Longest suffix first so 'i.ytimg.com' wins over 'ytimg.com'
+        self.host_pools = sorted((host_pools or {}).items(), key=lambda item: -len(item[0]))
+        super().__init__(**kwargs)
+
+    def pool_size_for(self, host):
+        host = (host or '').lower()
+        for suffix, size in self.host_pools:
+            if host == suffix or host.endswith('.' + suffix):
+                return size
+        return self._pool_maxsize
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        # A plain float timeout is the caller's deadline (the breaker passes one), retries included
+        if isinstance(timeout, (int, float)) and getattr(_deadline, 'at', None) is None:
+            with request_deadline(timeout):
+                return super().send(request, stream=stream, timeout=timeout, **kwargs)
+        return super().send(request, stream=stream, timeout=timeout, **kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        pool_kwargs['maxsize'] = self.pool_size_for(host_params['host'])
+        return host_params, pool_kwargs
+
+    def pool_stats(self):
+        """Per-host pool usage of this adapter"""
+        pools = self.poolmanager.pools
+        stats = []
+        with pools.lock:
+            pool_list = list(pools._container.values())
+        for pool in pool_list:
+            stats.append({
+                'host': pool.host,
+                'port': pool.port,
+                'scheme': pool.scheme,
+                'maxsize': pool.pool.maxsize,
+                # Connections idling in the pool, ready for reuse
+                'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None),
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+            })
+        return stats
+
+
+def _enable_http2():
+    """Opt into urllib3's HTTP/2 support, False if it isn't available here"""
+    try:
+        import h2  # noqa: F401
+        from urllib3.http2 import inject_into_urllib3
+    except ImportError:
+        return False
+    inject_into_urllib3()
+    return True
+
+
+def build_client(config=None):
+    config = config or http_client_config()
+    retry = BoundedRetry(
+        max_sleep=config['RETRY_MAX_SLEEP'],
+        total=config['RETRIES'],
+        connect=config['RETRIES'],
+        read=config['RETRIES'],
+        status=config['RETRIES'],
+        backoff_factor=config['BACKOFF_FACTOR'],
+        status_forcelist=tuple(config['RETRY_STATUSES']),
+        allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS'}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    session.headers.update({'User-Agent': USER_AGENT})
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, HostPoolAdapter(
+            host_pools=config['HOST_POOLS'],
+            pool_connections=config['POOL_CONNECTIONS'],
+            pool_maxsize=config['POOL_MAXSIZE'],
+            pool_block=config['POOL_BLOCK'],
+            max_retries=retry,
+        ))
+    return session
+
+
+def install_dns_cache(config=None):
+    """Put the DNS cache in front of socket.getaddrinfo, once per process"""
+    global _dns_cache
+    config = config or http_client_config()
+    with _dns_cache_lock:
+        if config['DNS_CACHE_TTL'] and _dns_cache is None:
+            _dns_cache = DNSCache(config['DNS_CACHE_TTL'], config['DNS_CACHE_MAX_ENTRIES'])
+            _dns_cache.install()
+
+
+def get_http_client():
+    """
+    The process-wide requests.Session used for every outbound HTTP call in the api package
+    Connections are kept alive per host, idempotent requests are retried with backoff
+    (bounded by the request timeout) and host lookups go through the DNS cache
+    """
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            config = http_client_config()
+            install_dns_cache(config)
+            if config['HTTP2'] and not _enable_http2():
+                logger.warning('HTTP/2 requested but the h2 package is not installed, using HTTP/1.1')
+            _client = build_client(config)
+    return _client
+
+
+def http_client_stats():
+    """Pool and DNS cache stats for the metrics endpoint"""
+    if _client is None:
+        return {'pools': [], 'dns_cache': None}
+    pools = []
+    seen = set()
+    for adapter in _client.adapters.values():
+        if isinstance(adapter, HostPoolAdapter) and id(adapter) not in seen:
+            seen.add(id(adapter))
+            pools.extend(adapter.pool_stats())
+    return {
+        'pools': pools,
+        'dns_cache': _dns_cache.snapshot() if _dns_cache is not None else None,
+    }
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yt_dlp
+from django.core.management.base import BaseCommand
+
+from api.download_profile import DownloadProfile
+
+
+class FragmentedAudioHandler(BaseHTTPRequestHandler):
+    """
+    Serves an HLS playlist and its fragments with simulated per-request latency
+    and a per-connection bandwidth cap, which is what makes serial fragment fetching slow
+    """
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/audio.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:10', '#EXT-X-MEDIA-SEQUENCE:0']
+            for index in range(server.fragments):
+                lines += ['#EXTINF:10.0,', f'frag{index}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            body = ('\n'.join(lines) + '\n').encode('ascii')
+            self._send(body, 'application/vnd.apple.mpegurl')
+        elif self.path.startswith('/frag'):
+            time.sleep(server.latency)
+            self._send(server.payload, 'video/mp2t', throttle=server.bandwidth)
+        else:
+            self.send_error(404)
+
+    def _send(self, body, content_type, throttle=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not throttle:
+            self.wfile.write(body)
+            return
+        chunk = 16 * 1024
+        for offset in range(0, len(body), chunk):
+            self.wfile.write(body[offset:offset + chunk])
+            time.sleep(chunk / throttle)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark download throughput against a local fragmented-HTTP fixture for several concurrency settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,2,4,8,16',
+                            help='Comma separated concurrent_fragments values to test')
+        parser.add_argument('--fragments', type=int, default=32, help='Number of fragments in the fixture')
+        parser.add_argument('--fragment-kb', type=int, default=256, help='Size of each fragment in KiB')
+        parser.add_argument('--latency-ms', type=int, default=50, help='Simulated per-request latency')
+        parser.add_argument('--bandwidth-kbps', type=int, default=4096,
+                            help='Per-connection bandwidth cap in KiB/s (0 disables)')
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per concurrency value, best is reported')
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FragmentedAudioHandler)
+        server.daemon_threads = True
+        server.fragments = options['fragments']
+        server.payload = os.urandom(options['fragment_kb'] * 1024)
+        server.latency = options['latency_ms'] / 1000
+        server.bandwidth = options['bandwidth_kbps'] * 1024
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        url = f'http://127.0.0.1:{server.server_address[1]}/audio.m3u8'
+        total_bytes = server.fragments * len(server.payload)
+        self.stdout.write(
+            f"Fixture: {server.fragments} x {options['fragment_kb']} KiB fragments, "
+            f"{options['latency_ms']} ms latency, {options['bandwidth_kbps']} KiB/s per connection"
+        )
+        self.stdout.write(f"{'concurrency':>12} {'seconds':>9} {'MiB/s':>8} {'speedup':>8}")
+
+        baseline = None
+        try:
+            for concurrency in [int(value) for value in options['concurrency'].split(',')]:
+                elapsed = min(self._run(url, concurrency) for _ in range(options['repeat']))
+                baseline = baseline or elapsed
+                throughput = total_bytes / elapsed / 1024 / 1024
+                self.stdout.write(f"{concurrency:>12} {elapsed:>9.2f} {throughput:>8.2f} {baseline / elapsed:>7.2f}x")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _run(self, url, concurrency):
+        temp_dir = tempfile.mkdtemp(prefix='bench_download_')
+        try:
+            profile = DownloadProfile.from_settings(concurrent_fragments=concurrency)
+            ydl_opts = profile.ydl_opts(os.path.join(temp_dir, 'audio.%(ext)s'), extract_audio=False)
+            ydl_opts.update({'format': 'best', 'noprogress': True})
+            start = time.perf_counter()
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.extract_info(url, download=True)
+            return time.perf_counter() - start
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,66 @@
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from rest_framework.request import Request
+
+from api.throttling import TokenBucketThrottle
+
+
+class BenchView:
+    throttle_scope = 'search'
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request overhead of TokenBucketThrottle against its SQLite backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help='Number of throttle checks')
+        parser.add_argument('--clients', type=int, default=100, help='Distinct client IPs to spread requests over')
+        parser.add_argument('--budget-ms', type=float, default=1.0, help='Overhead budget the p99 must stay under')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='bench_ratelimit_') as temp_dir:
+            rate_limit = {
+                'ENABLED': True,
+                'DB_PATH': os.path.join(temp_dir, 'ratelimit.sqlite3'),
+                'CAPACITY': 1_000_000,
+                'REFILL_PER_SECOND': 1000.0,
+                'COSTS': {'search': 1},
+            }
+            with override_settings(RATE_LIMIT=rate_limit):
+                samples = self._run(options['requests'], options['clients'])
+
+        samples.sort()
+        p50 = samples[len(samples) // 2]
+        p99 = samples[int(len(samples) * 0.99) - 1]
+        self.stdout.write(
+            f"{len(samples)} checks over {options['clients']} clients: "
+            f"mean {statistics.mean(samples) * 1000:.3f} ms, p50 {p50 * 1000:.3f} ms, "
+            f"p99 {p99 * 1000:.3f} ms, max {samples[-1] * 1000:.3f} ms"
+        )
+        if p99 * 1000 <= options['budget_ms']:
+            self.stdout.write(self.style.SUCCESS(f"p99 within {options['budget_ms']} ms budget"))
+        else:
+            self.stdout.write(self.style.ERROR(f"p99 exceeds {options['budget_ms']} ms budget"))
+
+    def _run(self, total, clients):
+        factory = RequestFactory()
+        requests = [
+            Request(factory.get('/api/search/', REMOTE_ADDR=f'10.0.{i // 256}.{i % 256}'))
+            for i in range(clients)
+        ]
+        view = BenchView()
+        # Warm up the connection and the table
+        TokenBucketThrottle().allow_request(requests[0], view)
+
+        samples = []
+        for i in range(total):
+            request = requests[i % clients]
+            start = time.perf_counter()
+            TokenBucketThrottle().allow_request(request, view)
+            samples.append(time.perf_counter() - start)
+        return samples
@@ -0,0 +1,478 @@
+import json
+import logging
+import os
+import random
+import string
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import ExitStack
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from api.pipeline import FetchStage, PostprocessStage, ResolveStage
+from api.youtube_search import SearchResult, YouTubeSearcher
+
+SEARCH_TERMS = (
+    'lofi hip hop', 'piano cover', 'live session', 'acoustic', 'synthwave', 'jazz trio',
+    'drum and bass', 'ambient', 'remix', 'orchestra', 'indie rock', 'bossa nova',
+)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def read_process_stats(pid):
+    """RSS in MiB and open file descriptors of a process, from /proc"""
+    rss = None
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+                    break
+    except FileNotFoundError:
+        pass
+    try:
+        fds = len(os.listdir(f'/proc/{pid}/fd'))
+    except (FileNotFoundError, PermissionError):
+        fds = None
+    return rss, fds
+
+
+def count_work_dirs():
+    """Pipeline work directories currently in the temp dir (ResolveStage's youtube_dl_*)"""
+    try:
+        return sum(1 for entry in os.scandir(tempfile.gettempdir()) if entry.name.startswith('youtube_dl_'))
+    except FileNotFoundError:
+        return 0
+
+
+class RequestMix:
+    """
+    Source of requests to send
+    Either replays a recorded JSONL file in a loop or draws synthetic search / thumbnail /
+    download requests according to the configured weights
+    """
+
+    def __init__(self, weights=None, records=None, video_pool=50, seed=None):
+        self.random = random.Random(seed)
+        self.records = records
+        self.weights = weights or {}
+        self.video_ids = [self._random_id() for _ in range(video_pool)]
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def _random_id(self):
+        return ''.join(self.random.choice(string.ascii_letters + string.digits + '-_') for _ in range(11))
+
+    @classmethod
+    def load_records(cls, path):
+        """
+        Recorded requests, one JSON object per line
+        {"method", "path", "params", "body"} is replayed as is; a line with only a
+        "query" (or "title") becomes a search for that text
+        """
+        records = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if 'path' in record:
+                    records.append({
+                        'method': record.get('method', 'GET').upper(),
+                        'path': record['path'],
+                        'params': record.get('params') or {},
+                        'body': record.get('body'),
+                        'kind': record.get('kind', record['path'].strip('/').split('/')[-1] or 'root'),
+                    })
+                elif record.get('query') or record.get('title'):
+                    records.append(cls._search(record.get('query') or record['title']))
+        if not records:
+            raise CommandError(f'No replayable requests in {path}')
+        return records
+
+    @staticmethod
+    def _search(query):
+        return {'method': 'GET', 'path': '/api/search/', 'params': {'q': query, 'max_results': 5},
+                'body': None, 'kind': 'search'}
+
+    def next(self):
+        if self.records:
+            with self._lock:
+                record = self.records[self._index % len(self.records)]
+                self._index += 1
+            return record
+
+        with self._lock:
+            kind = self.random.choices(list(self.weights), weights=list(self.weights.values()))[0]
+            video_id = self.random.choice(self.video_ids)
+            term = self.random.choice(SEARCH_TERMS)
+        if kind == 'search':
+            return self._search(term)
+        if kind == 'thumbnail':
+            return {'method': 'GET', 'path': '/api/thumbnail/', 'kind': kind, 'body': None,
+                    'params': {'url': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg'}}
+        if kind == 'download':
+            # A fresh ID every time: pool IDs would be track-store hits after their first download,
+            # and the pipeline and temp-dir paths this run watches would stop running
+            with self._lock:
+                video_id = self._random_id()
+            return {'method': 'POST', 'path': '/api/download/', 'kind': kind, 'params': {},
+                    'body': {'url': f'https://www.youtube.com/watch?v={video_id}'}}
+        if kind == 'resolve':
+            ids = self.random.sample(self.video_ids, min(10, len(self.video_ids)))
+            return {'method': 'POST', 'path': '/api/videos/resolve/', 'kind': kind, 'params': {},
+                    'body': {'ids': ids}}
+        raise CommandError(f'Unknown request kind {kind!r}')
+
+
+class UpstreamStandIns:
+    """
+    Replaces the YouTube-facing calls with local fakes for in-process runs
+    Everything between the view and the upstream call (breakers, caches, pipeline stages,
+    temp directories, serialization) still runs for real, so leaks there show up.
+    `error_rate` makes that fraction of upstream calls fail.
+    """
+
+    def __init__(self, latency, error_rate, audio_kb, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.audio = os.urandom(audio_kb * 1024)
+        self.random = random.Random(seed)
+
+    def _upstream(self):
+        time.sleep(self.latency * (0.5 + self.random.random()))
+        if self.random.random() < self.error_rate:
+            raise RuntimeError('stand-in upstream failure')
+
+    def search(self, searcher, query, max_results=10, timeout=None):
+        self._upstream()
+        return [
+            SearchResult(f'{zlib.crc32(f"{query}|{i}".encode()):011d}', f'{query} #{i}', '', 'Stand-in', 180 + i)
+            for i in range(max_results)
+        ]
+
+    def metadata(self, video_id, timeout=None):
+        self._upstream()
+        return SearchResult(video_id, f'Stand-in {video_id}', '', 'Stand-in', 180)
+
+    def thumbnail(self, url, timeout=None):
+        self._upstream()
+        return SimpleNamespace(status_code=200, content=self.audio[:8 * 1024])
+
+    def extract(self, stage, url, timeout=None):
+        self._upstream()
+        video_id = url.rsplit('=', 1)[-1][-11:]
+        return {'id': video_id, 'title': f'Stand-in {video_id}', 'ext': 'webm'}
+
+    def download(self, stage, ctx, timeout=None):
+        self._upstream()
+        path = os.path.join(ctx.work_dir, f'{ctx.video_id}.webm')
+        with open(path, 'wb') as f:
+            f.write(self.audio)
+        return {**ctx.info, 'requested_downloads': [{'filepath': path}]}
+
+    def postprocess(self, stage, ctx):
+        path = os.path.splitext(ctx.file_path)[0] + f'.{ctx.profile.audio_codec}'
+        os.replace(ctx.file_path, path)
+        ctx.file_path = path
+
+    def patches(self):
+        standins = self
+        return [
+            mock.patch.object(YouTubeSearcher, '_search', lambda s, *a, **k: standins.search(s, *a, **k)),
+            mock.patch.object(YouTubeSearcher, '_fallback_search', lambda s, *a, **k: standins.search(s, *a, **k)),
+            mock.patch('api.views._fetch_thumbnail', self.thumbnail),
+            mock.patch.object(ResolveStage, '_extract', lambda s, *a, **k: standins.extract(s, *a, **k)),
+            mock.patch.object(FetchStage, '_download', lambda s, *a, **k: standins.download(s, *a, **k)),
+            mock.patch.object(PostprocessStage, 'run', lambda s, ctx: standins.postprocess(s, ctx)),
+            mock.patch('api.metadata._extract', self.metadata),
+        ]
+
+
+class Stats:
+    """Latencies and outcomes of one ramp step"""
+
+    def __init__(self):
+        self.latencies = []
+        self.status = {}
+        self.errors = 0
+        self.by_kind = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, status, elapsed):
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.status[status] = self.status.get(status, 0) + 1
+            self.by_kind[kind] = self.by_kind.get(kind, 0) + 1
+            # Throttling and open-circuit rejections are expected answers, not failures
+            if status == 'exception' or (status >= 500 and status != 503):
+                self.errors += 1
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'requests': count,
+            'rps': round(count / elapsed, 1) if elapsed else 0.0,
+            'error_rate': round(self.errors / count, 4) if count else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            'status': {str(key): value for key, value in sorted(self.status.items(), key=lambda item: str(item[0]))},
+            'kinds': self.by_kind,
+        }
+
+
+class ResourceMonitor:
+    """Samples RSS, open fds and youtube_dl_* work directories of a process at a fixed interval"""
+
+    def __init__(self, pid, interval):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loadtest-monitor', daemon=True)
+        self._started = time.monotonic()
+
+    def sample(self, label=None):
+        rss, fds = read_process_stats(self.pid)
+        sample = {
+            't': round(time.monotonic() - self._started, 1),
+            'rss_mb': round(rss, 1) if rss is not None else None,
+            'fds': fds,
+            'work_dirs': count_work_dirs(),
+            'threads': threading.active_count() if self.pid == os.getpid() else None,
+        }
+        if label:
+            sample['label'] = label
+        self.samples.append(sample)
+        return sample
+
+    def start(self):
+        self.sample('start')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.sample('end')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay recorded or synthetic traffic against the API, ramping concurrency, and track '
+        'latency percentiles, error rate, open fds, temp-dir growth and RSS over time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=('inprocess', 'http'), default='inprocess',
+                            help='Run against the Django app in this process or a running server')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server URL for --target http')
+        parser.add_argument('--server-pid', type=int,
+                            help='PID of the server to watch for --target http (RSS, fds); defaults to this process')
+        parser.add_argument('--replay', help='JSONL file of recorded requests to replay in a loop')
+        parser.add_argument('--mix', default='search=70,thumbnail=25,download=5',
+                            help='Synthetic request weights (search, thumbnail, download, resolve)')
+        parser.add_argument('--ramp', default='1,4,8,16', help='Comma separated concurrency steps')
+        parser.add_argument('--step-seconds', type=float, default=10.0, help='Duration of each ramp step')
+        parser.add_argument('--soak-seconds', type=float, default=0.0,
+                            help='Keep the last concurrency step running this long afterwards')
+        parser.add_argument('--sample-seconds', type=float, default=5.0, help='Resource sampling interval')
+        parser.add_argument('--real-upstream', action='store_true',
+                            help='Hit YouTube for real in --target inprocess instead of using stand-ins')
+        parser.add_argument('--upstream-latency-ms', type=float, default=50.0, help='Mean stand-in upstream latency')
+        parser.add_argument('--upstream-error-rate', type=float, default=0.02,
+                            help='Fraction of stand-in upstream calls that fail')
+        parser.add_argument('--audio-kb', type=int, default=256, help='Size of the stand-in downloaded audio')
+        parser.add_argument('--keep-rate-limit', action='store_true', help="Don't disable the rate limiter in-process")
+        parser.add_argument('--max-fd-growth', type=int, default=20,
+                            help='Open fd growth over the run that is reported as a leak')
+        parser.add_argument('--seed', type=int, help='Seed for the synthetic mix and stand-ins')
+        parser.add_argument('--output', help='Write step results and resource samples as JSON to this file')
+
+    def handle(self, *args, **options):
+        ramp = [int(value) for value in options['ramp'].split(',') if value.strip()]
+        if not ramp or min(ramp) < 1:
+            raise CommandError('--ramp needs positive concurrency values')
+        if options['replay']:
+            mix = RequestMix(records=RequestMix.load_records(options['replay']), seed=options['seed'])
+        else:
+            mix = RequestMix(weights=self._parse_mix(options['mix']), seed=options['seed'])
+
+        inprocess = options['target'] == 'inprocess'
+        pid = os.getpid() if inprocess or not options['server_pid'] else options['server_pid']
+        monitor = ResourceMonitor(pid, options['sample_seconds'])
+
+        with ExitStack() as stack:
+            if inprocess:
+                self._setup_inprocess(stack, options)
+            monitor.start()
+            self.stdout.write(
+                f"{'concurrency':>11} {'secs':>6} {'reqs':>7} {'rps':>8} {'err%':>6} "
+                f"{'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'rss MB':>8} {'fds':>5} {'tmpdirs':>7}"
+            )
+            steps = [(concurrency, options['step_seconds']) for concurrency in ramp]
+            if options['soak_seconds'] > 0:
+                steps.append((ramp[-1], options['soak_seconds']))
+            results = []
+            for concurrency, seconds in steps:
+                result = self._run_step(mix, concurrency, seconds, options)
+                sample = monitor.sample(f'after c={concurrency}')
+                results.append({'concurrency': concurrency, 'seconds': seconds, **result, 'resources': sample})
+                self.stdout.write(
+                    f"{concurrency:>11} {seconds:>6.0f} {result['requests']:>7} {result['rps']:>8.1f} "
+                    f"{result['error_rate'] * 100:>6.2f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                    f"{result['p99_ms']:>8.1f} {self._fmt(sample['rss_mb']):>8} {self._fmt(sample['fds']):>5} "
+                    f"{sample['work_dirs']:>7}"
+                )
+            # Give background work (job threads, reaper threads) a moment before the final sample
+            time.sleep(min(2.0, options['sample_seconds']))
+            end = monitor.stop()
+
+        self._report(monitor.samples[0], end, results, options)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({'steps': results, 'samples': monitor.samples}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    @staticmethod
+    def _parse_mix(value):
+        weights = {}
+        for part in value.split(','):
+            kind, _, weight = part.partition('=')
+            try:
+                weights[kind.strip()] = float(weight)
+            except ValueError:
+                raise CommandError(f'Invalid --mix entry {part!r}, expected kind=weight')
+        unknown = set(weights) - {'search', 'thumbnail', 'download', 'resolve'}
+        if unknown:
+            raise CommandError(f"Unknown request kind(s) in --mix: {', '.join(sorted(unknown))}")
+        if sum(weights.values()) <= 0:
+            raise CommandError('--mix weights must add up to more than zero')
+        return weights
+
+    def _setup_inprocess(self, stack, options):
+        # Stand-in tracks and jobs go to a throwaway store, never the one real clients are served from
+        temp_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='loadtest_', ignore_cleanup_errors=True))
+        overrides = {
+            # Stand-in audio isn't decodable, analysis would only log failures
+            'AUDIO_ANALYSIS_ENABLED': options['real_upstream'],
+            'TRACK_STORE_DIR': os.path.join(temp_dir, 'track_store'),
+            'DOWNLOAD_JOB_DIR': os.path.join(temp_dir, 'download_jobs'),
+            # Every download stores a new track, keep a soak from filling the disk
+            'TRACK_STORE_MAX_BYTES': 200 * options['audio_kb'] * 1024,
+        }
+        if not options['keep_rate_limit']:
+            overrides['RATE_LIMIT'] = {**settings.RATE_LIMIT, 'ENABLED': False}
+        stack.enter_context(override_settings(**overrides))
+        if not options['real_upstream']:
+            standins = UpstreamStandIns(
+                options['upstream_latency_ms'] / 1000,
+                options['upstream_error_rate'],
+                options['audio_kb'],
+                seed=options['seed'],
+            )
+            for patch in standins.patches():
+                stack.enter_context(patch)
+        if options['verbosity'] < 2:
+            # Injected failures would otherwise flood the console
+            for name in ('api', 'django.request'):
+                logger = logging.getLogger(name)
+                stack.callback(logger.setLevel, logger.level)
+                logger.setLevel(logging.CRITICAL)
+
+    def _run_step(self, mix, concurrency, seconds, options):
+        stats = Stats()
+        deadline = time.monotonic() + seconds
+        inprocess = options['target'] == 'inprocess'
+
+        def worker():
+            if inprocess:
+                client = Client()
+                send = lambda record: self._send_inprocess(client, record)
+            else:
+                session = requests.Session()
+                send = lambda record: self._send_http(session, options['base_url'], record)
+            while time.monotonic() < deadline:
+                record = mix.next()
+                start = time.perf_counter()
+                try:
+                    status = send(record)
+                except Exception:
+                    status = 'exception'
+                stats.record(record['kind'], status, time.perf_counter() - start)
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=worker, name=f'loadtest-{i}', daemon=True) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return stats.summary(time.monotonic() - started)
+
+    @staticmethod
+    def _send_inprocess(client, record):
+        if record['method'] == 'GET':
+            response = client.get(record['path'], record['params'])
+        else:
+            path = record['path']
+            if record['params']:
+                path += '?' + '&'.join(f'{key}={value}' for key, value in record['params'].items())
+            response = client.generic(record['method'], path, json.dumps(record['body'] or {}),
+                                      content_type='application/json')
+        # Drain streamed bodies so generators (and their cleanup) run like they would for a real client
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        response.close()
+        return response.status_code
+
+    @staticmethod
+    def _send_http(session, base_url, record):
+        with session.request(record['method'], base_url.rstrip('/') + record['path'], params=record['params'],
+                             json=record['body'] if record['method'] != 'GET' else None,
+                             timeout=120, stream=True) as response:
+            for _ in response.iter_content(64 * 1024):
+                pass
+            return response.status_code
+
+    def _report(self, start, end, results, options):
+        total = sum(result['requests'] for result in results)
+        errors = sum(result['requests'] * result['error_rate'] for result in results)
+        self.stdout.write(
+            f"{total} requests, error rate {errors / total * 100 if total else 0:.2f}%, "
+            f"RSS {self._fmt(start['rss_mb'])} -> {self._fmt(end['rss_mb'])} MB, "
+            f"fds {self._fmt(start['fds'])} -> {self._fmt(end['fds'])}, "
+            f"work dirs {start['work_dirs']} -> {end['work_dirs']}"
+        )
+        leaks = []
+        if end['work_dirs'] > start['work_dirs']:
+            leaks.append(f"{end['work_dirs'] - start['work_dirs']} youtube_dl_* work directories left behind")
+        if start['fds'] is not None and end['fds'] is not None and end['fds'] - start['fds'] > options['max_fd_growth']:
+            leaks.append(f"open fds grew by {end['fds'] - start['fds']}")
+        for leak in leaks:
+            self.stdout.write(self.style.ERROR(f'Possible leak: {leak}'))
+        if not leaks:
+            self.stdout.write(self.style.SUCCESS('No leaks detected'))
+
+    @staticmethod
+    def _fmt(value):
+        return '-' if value is None else value
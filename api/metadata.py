@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import yt_dlp
+from django.conf import settings
+
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .track_store import get_track_store
+from .youtube_search import SearchResult, extract_video_id, watch_url
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.meta.json'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _resolve_executor():
+    """Shared pool, so concurrent bulk requests together never exceed VIDEO_RESOLVE_WORKERS extractions"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'VIDEO_RESOLVE_WORKERS', 8),
+                thread_name_prefix='video-resolve',
+            )
+        return _executor
+
+
+def _ttl():
+    return getattr(settings, 'VIDEO_METADATA_TTL', 7 * 24 * 60 * 60)
+
+
+def load(video_id):
+    """Stored metadata for a track, None if missing or older than VIDEO_METADATA_TTL"""
+    data = get_track_store().read_json(video_id, SUFFIX)
+    if data is None:
+        return None
+    if time.time() - data.get('fetched', 0) > _ttl():
+        return None
+    return SearchResult(*(data.get(slot) for slot in SearchResult.__slots__))
+
+
+def remember(results):
+    """
+    Keep search/extraction results in the metadata store for later bulk lookups
+    Entries written less than half a TTL ago are left alone, so repeat searches
+    only cost a stat per result instead of a rewrite
+    """
+    store = get_track_store()
+    now = time.time()
+    for result in results:
+        if not store.is_valid_id(result.id):
+            continue
+        try:
+            if now - os.path.getmtime(store.path(result.id, SUFFIX)) < _ttl() / 2:
+                continue
+        except OSError:
+            pass
+        data = {slot: getattr(result, slot) for slot in SearchResult.__slots__}
+        data['fetched'] = now
+        try:
+            store.write_json(result.id, SUFFIX, data)
+        except OSError as e:
+            logger.warning('could not store metadata', extra={'video_id': result.id, 'error': str(e)})
+
+
+def _extract(video_id, timeout=None):
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'socket_timeout': timeout,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        # process=False: metadata only, no format selection
+        info = ydl.extract_info(watch_url(video_id), download=False, process=False)
+    return SearchResult.from_entry(info)
+
+
+def resolve_one(video_id):
+    # The breaker's default predicate keeps unavailable/private/unsupported videos from counting
+    result = get_breaker('youtube.extract').call(_extract, video_id)
+    remember([result])
+    return result
+
+
+class BulkResolver:
+    """
+    Metadata for many tracks, yielded as NDJSON lines in completion order
+    Store hits come out immediately; the rest is extracted on the shared resolve pool.
+    At most `max_misses` IDs are extracted per request, the others get a 'deferred' line
+    so the client can send them again later.
+    Closing the iterator early cancels extractions that haven't started yet.
+    """
+
+    def __init__(self, items, max_misses=None):
+        self.items = items
+        self.max_misses = max_misses
+        self._prepared = None
+
+    def parse(self):
+        """Split the request into (video IDs, lines for unusable items), dropping duplicates"""
+        video_ids = []
+        invalid = []
+        for item in self.items:
+            video_id = extract_video_id(item) if isinstance(item, str) else None
+            if video_id is None:
+                invalid.append({'input': item, 'error': 'Not a YouTube video ID or URL'})
+            elif video_id not in video_ids:
+                video_ids.append(video_id)
+        return video_ids, invalid
+
+    def prepare(self):
+        """(lines for unusable items, store hits, IDs to extract, deferred IDs), computed once"""
+        if self._prepared is None:
+            video_ids, invalid = self.parse()
+            hits = []
+            missing = []
+            for video_id in video_ids:
+                result = load(video_id)
+                if result is None:
+                    missing.append(video_id)
+                else:
+                    hits.append(result)
+            cut = len(missing) if self.max_misses is None else self.max_misses
+            self._prepared = (invalid, hits, missing[:cut], missing[cut:])
+        return self._prepared
+
+    @property
+    def misses(self):
+        """Number of IDs this request will extract upstream"""
+        return len(self.prepare()[2])
+
+    def __iter__(self):
+        invalid, hits, missing, deferred = self.prepare()
+        for line in invalid:
+            yield self._encode(line)
+        for result in hits:
+            yield self._encode(self._line(result, 'store'))
+        for video_id in deferred:
+            yield self._encode({
+                'id': video_id,
+                'error': f'At most {self.max_misses} uncached IDs are resolved per request',
+                'deferred': True,
+            })
+
+        executor = _resolve_executor()
+        futures = {executor.submit(resolve_one, video_id): video_id for video_id in missing}
+        try:
+            for future in as_completed(futures):
+                video_id = futures[future]
+                try:
+                    line = self._line(future.result(), 'upstream')
+                except CircuitOpenError as e:
+                    line = {'id': video_id, 'error': str(e), 'retry_after': round(e.retry_after, 1)}
+                except Exception as e:
+                    logger.warning('metadata resolution failed', extra={'video_id': video_id, 'error': str(e)})
+                    line = {'id': video_id, 'error': str(e)}
+                yield self._encode(line)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    @staticmethod
+    def _line(result, source):
+        return {**result.as_dict(SearchResult.FIELDS), 'source': source}
+
+    @staticmethod
+    def _encode(line):
+        return (json.dumps(line, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
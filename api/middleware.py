@@ -0,0 +1,18 @@
+class RateLimitHeadersMiddleware:
+    """
+    Adds X-RateLimit-* headers for requests that went through TokenBucketThrottle
+    Retry-After on throttled (429) responses is set by DRF itself
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit:
+            response['X-RateLimit-Limit'] = str(rate_limit['limit'])
+            response['X-RateLimit-Remaining'] = str(rate_limit['remaining'])
+            response['X-RateLimit-Reset'] = str(rate_limit['reset'])
+            response['X-RateLimit-Cost'] = str(rate_limit['cost'])
+        return response
@@ -0,0 +1,717 @@
+"""
+Download pipeline shared by the API views and Video2Audio
+
+A pipeline runs a list of stages over a PipelineContext:
+
+    resolve -> fetch -> postprocess -> store -> serve
+
+Stages are plain objects with a `name` and a `run(ctx)` method, so callers can
+drop, replace or add stages. Hooks get called around every stage and are used
+for timing and caching (a hook may satisfy a stage and skip it).
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import yt_dlp
+from django.conf import settings
+from django.http import HttpResponse
+from yt_dlp.postprocessor import FFmpegExtractAudioPP
+
+from .audio_analysis import ANALYZER_VERSION, AnalysisError, LoudnessAnalyzer, iter_pcm
+from .circuit_breaker import get_breaker
+from .download_profile import DownloadProfile
+from .track_store import get_track_store
+from .tracing import STAGE_SPANS, add_span
+from .youtube_search import extract_video_id
+from .waveform import META_SUFFIX, PEAKS_SUFFIX, PeakAccumulator, build_pyramid
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineError(Exception):
+    """Raised when a stage cannot produce what the next stage needs"""
+
+
+class PipelineContext:
+    """State threaded through the stages of one pipeline run"""
+
+    def __init__(self, url, profile=None, output_dir=None, keep_file=False, **options):
+        self.url = url
+        self.profile = profile or DownloadProfile.from_settings()
+        self.output_dir = output_dir
+        self.keep_file = keep_file or bool(output_dir)
+        self.options = options
+
+        self.work_dir = None
+        self.info = None
+        self.file_path = None
+        self.audio_data = None
+        self.response = None
+        self.timings = {}
+        self.extras = {}
+
+    @property
+    def video_id(self):
+        return (self.info or {}).get('id')
+
+    @property
+    def title(self):
+        return (self.info or {}).get('title') or 'audio'
+
+    @property
+    def size(self):
+        if self.audio_data is not None:
+            return len(self.audio_data)
+        if self.file_path and os.path.exists(self.file_path):
+            return os.path.getsize(self.file_path)
+        return 0
+
+    def cleanup(self):
+        """Remove the temporary work directory, if this run still owns one"""
+        if self.work_dir and os.path.exists(self.work_dir):
+            try:
+                shutil.rmtree(self.work_dir)
+                logger.debug('temp directory removed', extra={'path': self.work_dir})
+            except Exception as cleanup_error:
+                logger.warning('temp directory cleanup failed', extra={'path': self.work_dir, 'error': str(cleanup_error)})
+        self.work_dir = None
+
+
+class ResolveStage:
+    """Extract video metadata without downloading anything"""
+    name = 'resolve'
+
+    def run(self, ctx):
+        if not ctx.url:
+            raise PipelineError('URL required')
+        ctx.work_dir = tempfile.mkdtemp(prefix='youtube_dl_')
+        ctx.info = get_breaker('youtube.extract').call(self._extract, ctx.url)
+        logger.info('resolved', extra={'video_id': ctx.video_id, 'title': ctx.title})
+
+    def _extract(self, url, timeout=None):
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'socket_timeout': timeout}) as ydl:
+            return ydl.extract_info(url, download=False, process=False)
+
+
+class FetchStage:
+    """Select the best audio format and download it into the work directory"""
+    name = 'fetch'
+
+    def run(self, ctx):
+        ctx.info = get_breaker('youtube.download').call(self._download, ctx)
+        downloads = ctx.info.get('requested_downloads') or []
+        if not downloads or not downloads[0].get('filepath'):
+            raise PipelineError('Download completed but yt-dlp reported no output file')
+        ctx.file_path = downloads[0]['filepath']
+
+    def ydl_opts(self, ctx, timeout):
+        output_template = os.path.join(ctx.work_dir, '%(id)s.%(ext)s')
+        ydl_opts = ctx.profile.ydl_opts(output_template, extract_audio=False)
+        ydl_opts['socket_timeout'] = timeout
+        return ydl_opts
+
+    def _download(self, ctx, timeout=None):
+        with yt_dlp.YoutubeDL(self.ydl_opts(ctx, timeout)) as ydl:
+            return ydl.process_ie_result(ctx.info, download=True)
+
+
+class PostprocessStage:
+    """Transcode the downloaded stream to the profile's audio codec with FFmpeg"""
+    name = 'postprocess'
+
+    def run(self, ctx):
+        download = {**ctx.info, **ctx.info['requested_downloads'][0]}
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            extractor = FFmpegExtractAudioPP(
+                ydl,
+                preferredcodec=ctx.profile.audio_codec,
+                preferredquality=ctx.profile.audio_quality,
+            )
+            download = ydl.run_pp(extractor, download)
+        ctx.file_path = download['filepath']
+
+        if not os.path.exists(ctx.file_path):
+            raise PipelineError('Postprocessing completed but output file not found')
+        file_size = os.path.getsize(ctx.file_path)
+        if file_size == 0:
+            raise PipelineError('Downloaded file is empty')
+        logger.info('transcoded', extra={'video_id': ctx.video_id, 'bytes': file_size})
+
+
+class AnalysisStage:
+    """
+    Integrated loudness, peak, duration and waveform peaks of the transcoded audio
+    The audio is decoded once and every chunk feeds both the loudness analyzer and the
+    waveform peak accumulator. Results are kept per video ID in the track store, so each
+    track is analysed once. Analysis is best effort: a failure is logged and the download
+    carries on without it.
+
+    This is a second full decode, so it only runs in pipelines nobody is waiting on
+    (background jobs, Video2Audio). Synchronous downloads use schedule_analysis() instead.
+    """
+    name = 'analyze'
+    suffix = '.analysis.json'
+
+    def run(self, ctx):
+        analysis = load_analysis(ctx.video_id)
+        if analysis is None:
+            try:
+                analysis = analyze_track(ctx.video_id, ctx.file_path)
+            except AnalysisError as e:
+                logger.warning('audio analysis failed', extra={'video_id': ctx.video_id, 'error': str(e)})
+                return
+        ctx.extras['analysis'] = analysis
+
+
+def load_analysis(video_id):
+    """Stored analysis of a track if it's current and has its waveform peaks, else None"""
+    store = get_track_store()
+    analysis = store.read_json(video_id, AnalysisStage.suffix)
+    if analysis is None or analysis.get('analyzer_version') != ANALYZER_VERSION:
+        return None
+    if not store.exists(video_id, PEAKS_SUFFIX):
+        return None
+    return analysis
+
+
+def analyze_track(video_id, path):
+    """Analyse an audio file and keep the results in the track store"""
+    store = get_track_store()
+    analyzer = LoudnessAnalyzer()
+    peaks = PeakAccumulator()
+    for chunk in iter_pcm(path):
+        analyzer.feed(chunk)
+        peaks.feed(chunk)
+    analysis = analyzer.result()
+
+    if store.is_valid_id(video_id):
+        pyramid, levels = build_pyramid(peaks.result())
+        with store.open_atomic(video_id, PEAKS_SUFFIX) as f:
+            np.save(f, pyramid)
+        store.write_json(video_id, META_SUFFIX, {
+            'levels': levels,
+            'sample_rate': analyzer.sample_rate,
+            'duration': analysis['duration'],
+        })
+        store.write_json(video_id, AnalysisStage.suffix, analysis)
+    logger.info('analysed', extra={
+        'video_id': video_id,
+        'lufs': analysis['integrated_lufs'],
+        'peak_dbfs': analysis['peak_dbfs'],
+    })
+    return analysis
+
+
+_analysis_executor = None
+_analysis_pending = set()
+_analysis_lock = threading.Lock()
+
+
+def schedule_analysis(video_id, path):
+    """
+    Analyse a stored track in the background, off the request path
+    The first download of a track is served without loudness headers; later requests
+    (and /api/analysis/, /api/waveform/) pick the stored result up
+    """
+    global _analysis_executor
+    with _analysis_lock:
+        if video_id in _analysis_pending:
+            return
+        _analysis_pending.add(video_id)
+        if _analysis_executor is None:
+            _analysis_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-analysis')
+    _analysis_executor.submit(_analyze_in_background, video_id, path)
+
+
+def _analyze_in_background(video_id, path):
+    try:
+        analyze_track(video_id, path)
+    except (AnalysisError, OSError) as e:
+        logger.warning('audio analysis failed', extra={'video_id': video_id, 'error': str(e)})
+    finally:
+        with _analysis_lock:
+            _analysis_pending.discard(video_id)
+
+
+class StoreStage:
+    """
+    Move the finished file to its final location
+    With keep_file the file stays on disk (in output_dir if given), otherwise it is
+    read into memory and the work directory is removed straight away
+    """
+    name = 'store'
+
+    def run(self, ctx):
+        if ctx.keep_file:
+            if ctx.output_dir:
+                os.makedirs(ctx.output_dir, exist_ok=True)
+                safe_name = safe_filename(ctx.title) or ctx.video_id or 'audio'
+                ext = os.path.splitext(ctx.file_path)[1]
+                destination = os.path.join(ctx.output_dir, f'{safe_name}{ext}')
+                shutil.move(ctx.file_path, destination)
+                ctx.file_path = destination
+                ctx.cleanup()
+            return
+
+        with open(ctx.file_path, 'rb') as audio_file:
+            ctx.audio_data = audio_file.read()
+        logger.debug('file read into memory', extra={'bytes': len(ctx.audio_data)})
+        ctx.file_path = None
+        ctx.cleanup()
+
+
+class ServeStage:
+    """Build the HTTP response for the stored audio"""
+    name = 'serve'
+
+    def __init__(self, disposition='attachment', cache_control='no-cache'):
+        self.disposition = disposition
+        self.cache_control = cache_control
+
+    def run(self, ctx):
+        if ctx.audio_data is None:
+            with open(ctx.file_path, 'rb') as audio_file:
+                ctx.audio_data = audio_file.read()
+
+        ext = ctx.profile.audio_codec
+        response = HttpResponse(
+            ctx.audio_data,
+            content_type=AUDIO_CONTENT_TYPES.get(ext, 'application/octet-stream')
+        )
+        response['Content-Disposition'] = f'{self.disposition}; filename="{safe_filename(ctx.title)}.{ext}"'
+        response['Content-Length'] = len(ctx.audio_data)
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = self.cache_control
+        add_analysis_headers(response, ctx.extras.get('analysis'))
+        ctx.response = response
+        logger.info('response ready', extra={'video_id': ctx.video_id, 'bytes': len(ctx.audio_data)})
+
+
+AUDIO_CONTENT_TYPES = {
+    'mp3': 'audio/mpeg',
+    'm4a': 'audio/mp4',
+    'aac': 'audio/aac',
+    'opus': 'audio/ogg',
+    'vorbis': 'audio/ogg',
+    'flac': 'audio/flac',
+    'wav': 'audio/wav',
+}
+
+
+def add_analysis_headers(response, analysis):
+    """Expose loudness analysis so clients can normalize without decoding the audio"""
+    if not analysis:
+        return
+    headers = {
+        'X-Loudness-LUFS': analysis.get('integrated_lufs'),
+        'X-ReplayGain-Track-Gain': analysis.get('replaygain_track_gain'),
+        'X-ReplayGain-Track-Peak': analysis.get('replaygain_track_peak'),
+        'X-Audio-Duration': analysis.get('duration'),
+    }
+    for header, value in headers.items():
+        if value is not None:
+            response[header] = str(value)
+
+
+def safe_filename(name):
+    return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_'))[:50]
+
+
+class PipelineHook:
+    """
+    Base class for pipeline hooks
+    before_stage may return True to mark the stage as already satisfied (e.g. from a cache)
+    """
+
+    def before_stage(self, stage, ctx):
+        return False
+
+    def after_stage(self, stage, ctx, elapsed):
+        pass
+
+    def on_error(self, stage, ctx, error):
+        pass
+
+
+class TimingHook(PipelineHook):
+    """Record wall time per stage in ctx.timings and in the request's Server-Timing breakdown"""
+
+    def after_stage(self, stage, ctx, elapsed):
+        ctx.timings[stage.name] = elapsed
+        add_span(STAGE_SPANS.get(stage.name, stage.name), elapsed)
+
+
+class JobStateHook(PipelineHook):
+    """Save a background job's record after every stage"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def after_stage(self, stage, ctx, elapsed):
+        self.job.save()
+
+
+class TrackCacheHook(PipelineHook):
+    """
+    Serve full tracks already transcoded into the track store and add new ones to it
+    The video ID is parsed from the URL, so a hit skips every stage up to serving,
+    including the yt-dlp metadata lookup. The piped download mode fills the same entries.
+    New tracks are queued for background analysis (see schedule_analysis).
+    """
+    info_suffix = '.track.json'
+
+    def before_stage(self, stage, ctx):
+        if stage.name == 'serve':
+            return False
+        if 'cached' not in ctx.extras:
+            ctx.extras['cached'] = self._load(ctx)
+        return ctx.extras['cached']
+
+    def __init__(self, analyze=None):
+        if analyze is None:
+            analyze = getattr(settings, 'AUDIO_ANALYSIS_ENABLED', True)
+        self.analyze = analyze
+
+    def after_stage(self, stage, ctx, elapsed):
+        if stage.name != 'postprocess':
+            return
+        store = get_track_store()
+        if not store.is_valid_id(ctx.video_id):
+            return
+        try:
+            with open(ctx.file_path, 'rb') as source, store.open_atomic(ctx.video_id, track_suffix(ctx.profile)) as f:
+                shutil.copyfileobj(source, f)
+            store.write_json(ctx.video_id, self.info_suffix, {'title': ctx.title})
+        except OSError as e:
+            logger.warning('could not cache track', extra={'video_id': ctx.video_id, 'error': str(e)})
+            return
+        if not self.analyze:
+            return
+        analysis = load_analysis(ctx.video_id)
+        if analysis is None:
+            schedule_analysis(ctx.video_id, store.path(ctx.video_id, track_suffix(ctx.profile)))
+        else:
+            ctx.extras['analysis'] = analysis
+
+    def _load(self, ctx):
+        store = get_track_store()
+        video_id = extract_video_id(ctx.url)
+        suffix = track_suffix(ctx.profile)
+        if not store.exists(video_id, suffix):
+            return False
+        try:
+            with open(store.path(video_id, suffix), 'rb') as track_file:
+                ctx.audio_data = track_file.read()
+        except FileNotFoundError:
+            return False
+        store.touch(video_id, suffix)
+        info = store.read_json(video_id, self.info_suffix) or {}
+        ctx.info = {'id': video_id, 'title': info.get('title') or video_id}
+        analysis = store.read_json(video_id, AnalysisStage.suffix)
+        if analysis:
+            ctx.extras['analysis'] = analysis
+        logger.info('track cache hit', extra={'video_id': video_id})
+        return True
+
+
+def track_suffix(profile):
+    """Track store suffix of a full transcoded track"""
+    return f'.{profile.audio_codec}'
+
+
+def default_stages(serve=True, analyze=None):
+    """
+    Standard stage list
+    By default analysis only runs inline when nothing is served, i.e. when no client
+    is waiting on the result
+    """
+    if analyze is None:
+        analyze = getattr(settings, 'AUDIO_ANALYSIS_ENABLED', True) and not serve
+    stages = [ResolveStage(), FetchStage(), PostprocessStage()]
+    if analyze:
+        stages.append(AnalysisStage())
+    stages.append(StoreStage())
+    if serve:
+        stages.append(ServeStage())
+    return stages
+
+
+class DownloadPipeline:
+    """
+    Runs stages in order over a fresh PipelineContext
+    Use run() for synchronous requests and submit() for background jobs
+    """
+
+    def __init__(self, stages=None, hooks=None):
+        self.stages = list(stages) if stages is not None else default_stages()
+        self.hooks = list(hooks) if hooks is not None else [TimingHook()]
+
+    def run(self, url, **options):
+        ctx = options.pop('context', None) or PipelineContext(url, **options)
+        try:
+            for stage in self.stages:
+                self._run_stage(stage, ctx)
+        except Exception:
+            ctx.cleanup()
+            raise
+        return ctx
+
+    def _run_stage(self, stage, ctx):
+        if any(hook.before_stage(stage, ctx) for hook in self.hooks):
+            return
+        start = time.perf_counter()
+        try:
+            stage.run(ctx)
+        except Exception as error:
+            for hook in self.hooks:
+                hook.on_error(stage, ctx, error)
+            raise
+        elapsed = time.perf_counter() - start
+        for hook in self.hooks:
+            hook.after_stage(stage, ctx, elapsed)
+
+    def submit(self, url, **options):
+        """Run the pipeline in the background job pool and return its PipelineJob"""
+        options.setdefault('keep_file', True)
+        job = PipelineJob(PipelineContext(url, **options))
+        job.save()
+        job.future = _job_executor().submit(self._run_job, job)
+        return job
+
+    def _run_job(self, job):
+        job.status = PipelineJob.RUNNING
+        job.save()
+        # Persist progress so a sweep can clean up the work directory if this process dies
+        pipeline = DownloadPipeline(self.stages, self.hooks + [JobStateHook(job)])
+        try:
+            pipeline.run(job.ctx.url, context=job.ctx)
+            job.status = PipelineJob.DONE
+        except Exception as e:
+            logger.error('background download failed', extra={'job_id': job.id, 'url': job.ctx.url}, exc_info=True)
+            job.error = str(e)
+            job.status = PipelineJob.FAILED
+        finally:
+            job.finished_at = time.time()
+            job.save()
+
+
+class PipelineJob:
+    """
+    Handle for a pipeline running in background-job mode
+    Job state is persisted in the job store, so any worker process can report on it
+    and serve the result, not just the one running the pipeline
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, ctx, id=None):
+        self.id = id or uuid.uuid4().hex
+        self.ctx = ctx
+        self.status = self.PENDING
+        self.error = None
+        self.future = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.pid = os.getpid()
+
+    def as_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'url': self.ctx.url,
+            'timings': {name: round(elapsed, 3) for name, elapsed in self.ctx.timings.items()},
+        }
+        if self.ctx.info:
+            data.update({'id': self.ctx.video_id, 'title': self.ctx.title})
+        if self.status == self.DONE:
+            data['size'] = self.ctx.size
+        if self.ctx.extras.get('analysis'):
+            data['analysis'] = self.ctx.extras['analysis']
+        if self.error:
+            data['error'] = self.error
+        return data
+
+    def save(self):
+        get_job_store().write(self.id, {
+            'status': self.status,
+            'url': self.ctx.url,
+            'info': {'id': self.ctx.video_id, 'title': self.ctx.title} if self.ctx.info else None,
+            'timings': self.ctx.timings,
+            'analysis': self.ctx.extras.get('analysis'),
+            'error': self.error,
+            'file_path': self.ctx.file_path,
+            'work_dir': self.ctx.work_dir,
+            'pid': self.pid,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        })
+
+    @classmethod
+    def from_record(cls, job_id, record):
+        ctx = PipelineContext(record['url'], keep_file=True)
+        ctx.info = record['info']
+        ctx.timings = record['timings']
+        ctx.file_path = record['file_path']
+        ctx.work_dir = record['work_dir']
+        if record['analysis']:
+            ctx.extras['analysis'] = record['analysis']
+        job = cls(ctx, id=job_id)
+        job.status = record['status']
+        job.error = record['error']
+        job.pid = record['pid']
+        job.created_at = record['created_at']
+        job.finished_at = record['finished_at']
+        return job
+
+
+class JobStore:
+    """
+    Background job records as JSON files in a directory shared by all worker processes
+    Records are replaced atomically; removing one is how a worker claims a finished job.
+    """
+
+    _JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def write(self, job_id, record):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp_')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(record, f, separators=(',', ':'))
+        os.replace(temp_path, self.path(job_id))
+
+    def read(self, job_id):
+        if not self._JOB_ID_RE.match(job_id or ''):
+            return None
+        try:
+            with open(self.path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def remove(self, job_id):
+        """Delete a record, False if it was already gone (another worker got there first)"""
+        try:
+            os.remove(self.path(job_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def job_ids(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [name[:-5] for name in names if name.endswith('.json') and self._JOB_ID_RE.match(name[:-5])]
+
+
+_job_store = None
+_jobs_lock = threading.Lock()
+_executor = None
+_next_sweep = 0.0
+
+
+def get_job_store():
+    global _job_store
+    directory = getattr(settings, 'DOWNLOAD_JOB_DIR', os.path.join(tempfile.gettempdir(), 'download_jobs'))
+    if _job_store is None or _job_store.directory != directory:
+        _job_store = JobStore(directory)
+    return _job_store
+
+
+def _job_executor():
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DOWNLOAD_JOB_WORKERS', 2),
+                thread_name_prefix='download-job',
+            )
+            threading.Thread(target=_sweep_loop, name='download-job-sweeper', daemon=True).start()
+        return _executor
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def sweep_jobs(now=None):
+    """
+    Remove jobs finished more than DOWNLOAD_JOB_TTL ago and jobs whose worker process
+    died mid-run, together with their work directories
+    """
+    ttl = getattr(settings, 'DOWNLOAD_JOB_TTL', 15 * 60)
+    now = time.time() if now is None else now
+    store = get_job_store()
+    removed = 0
+    for job_id in store.job_ids():
+        record = store.read(job_id)
+        if record is None:
+            continue
+        if record['finished_at']:
+            stale = now - record['finished_at'] > ttl
+        else:
+            stale = not _pid_alive(record['pid'])
+        if stale and store.remove(job_id):
+            if record['work_dir']:
+                shutil.rmtree(record['work_dir'], ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.info('expired download jobs removed', extra={'count': removed})
+    return removed
+
+
+def _maybe_sweep():
+    """Sweep at most once per DOWNLOAD_JOB_SWEEP_INTERVAL in this process"""
+    global _next_sweep
+    now = time.time()
+    if now < _next_sweep:
+        return
+    _next_sweep = now + getattr(settings, 'DOWNLOAD_JOB_SWEEP_INTERVAL', 60)
+    try:
+        sweep_jobs(now)
+    except OSError as e:
+        logger.warning('download job sweep failed', extra={'error': str(e)})
+
+
+def _sweep_loop():
+    while True:
+        _maybe_sweep()
+        time.sleep(getattr(settings, 'DOWNLOAD_JOB_SWEEP_INTERVAL', 60))
+
+
+def get_job(job_id):
+    _maybe_sweep()
+    record = get_job_store().read(job_id)
+    return PipelineJob.from_record(job_id, record) if record is not None else None
+
+
+def pop_job(job_id):
+    """Claim a job for serving; None if it's gone or another worker claimed it first"""
+    job = get_job(job_id)
+    if job is None or not get_job_store().remove(job_id):
+        return None
+    return job
@@ -0,0 +1,114 @@
+import logging
+
+from django.conf import settings
+from yt_dlp.utils import download_range_func
+
+from .pipeline import (
+    DownloadPipeline, FetchStage, PipelineError, PipelineHook, PostprocessStage, ResolveStage,
+    ServeStage, TimingHook
+)
+from .track_store import get_track_store
+
+logger = logging.getLogger(__name__)
+
+
+def clip_suffix(start, length, codec):
+    return f'.preview_{start}_{length}.{codec}'
+
+
+class ClipFetchStage(FetchStage):
+    """
+    Download only the requested time window of the source stream
+    yt-dlp hands the section to FFmpeg, which seeks in the remote stream instead of
+    fetching the whole file, and cuts on exact timestamps
+    """
+
+    def ydl_opts(self, ctx, timeout):
+        ydl_opts = super().ydl_opts(ctx, timeout)
+        start = ctx.options['start']
+        ydl_opts['download_ranges'] = download_range_func(None, [(start, start + ctx.options['length'])])
+        ydl_opts['force_keyframes_at_cuts'] = True
+        return ydl_opts
+
+
+class ClipStoreStage:
+    """Keep the transcoded clip in the track store and load it for serving"""
+    name = 'store'
+
+    def run(self, ctx):
+        store = get_track_store()
+        suffix = clip_suffix(ctx.options['start'], ctx.options['length'], ctx.profile.audio_codec)
+        with open(ctx.file_path, 'rb') as clip_file:
+            ctx.audio_data = clip_file.read()
+        if store.is_valid_id(ctx.video_id):
+            with store.open_atomic(ctx.video_id, suffix) as f:
+                f.write(ctx.audio_data)
+        ctx.file_path = None
+        ctx.cleanup()
+
+
+class ClipCacheHook(PipelineHook):
+    """
+    Serve clips already in the track store
+    The video ID is parsed from the URL up front, so a hit skips every stage up to
+    serving, including the yt-dlp metadata lookup
+    """
+
+    def before_stage(self, stage, ctx):
+        if stage.name == 'serve':
+            return False
+        if 'cached' not in ctx.extras:
+            ctx.extras['cached'] = self._load(ctx)
+        return ctx.extras['cached']
+
+    def _load(self, ctx):
+        store = get_track_store()
+        video_id = ctx.options.get('video_id')
+        suffix = clip_suffix(ctx.options['start'], ctx.options['length'], ctx.profile.audio_codec)
+        if not store.exists(video_id, suffix):
+            return False
+        try:
+            with open(store.path(video_id, suffix), 'rb') as clip_file:
+                ctx.audio_data = clip_file.read()
+        except FileNotFoundError:
+            # Evicted since the check
+            return False
+        store.touch(video_id, suffix)
+        ctx.info = {'id': video_id, 'title': f'{video_id} preview'}
+        logger.info('preview cache hit', extra={
+            'video_id': video_id,
+            'start': ctx.options['start'],
+            'length': ctx.options['length'],
+        })
+        return True
+
+
+def preview_limits():
+    return (
+        getattr(settings, 'PREVIEW_MIN_SECONDS', 5),
+        getattr(settings, 'PREVIEW_MAX_SECONDS', 30),
+        getattr(settings, 'PREVIEW_DEFAULT_SECONDS', 20),
+    )
+
+
+def snap_start(start):
+    """Round a clip start down to the PREVIEW_START_GRID_SECONDS grid"""
+    grid = getattr(settings, 'PREVIEW_START_GRID_SECONDS', 5)
+    return max(0, int(start // grid * grid))
+
+
+def build_preview(url, video_id, start, length):
+    """Run the clip pipeline, returns the pipeline context with the response"""
+    if length <= 0:
+        raise PipelineError('Preview length must be positive')
+    pipeline = DownloadPipeline(
+        stages=[
+            ResolveStage(),
+            ClipFetchStage(),
+            PostprocessStage(),
+            ClipStoreStage(),
+            ServeStage(disposition='inline', cache_control='public, max-age=86400'),
+        ],
+        hooks=[ClipCacheHook(), TimingHook()],
+    )
+    return pipeline.run(url, video_id=video_id, start=start, length=length)
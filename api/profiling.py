@@ -0,0 +1,161 @@
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+PROFILE_NAME_RE = re.compile(r'^[0-9]{8}T[0-9]{6}_[a-z0-9_]+_[0-9a-f]{8}\.(prof|folded)$')
+
+
+def profiling_config():
+    return {
+        'ENABLED': False,
+        'SAMPLE_RATE': 0.0,
+        'MODE': 'cprofile',
+        'DIR': os.path.join('/tmp', 'api_profiles'),
+        'MAX_FILES': 50,
+        'SAMPLE_INTERVAL': 0.005,
+        **getattr(settings, 'PROFILING', {}),
+    }
+
+
+class StackSampler:
+    """
+    Low-overhead sampling profiler for one thread
+    A background thread snapshots the target thread's stack every `interval` seconds and
+    counts identical stacks; the result is written in collapsed ("folded") format that
+    flamegraph tools read directly
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in profiling of live requests
+    A request is profiled when it's picked by PROFILING['SAMPLE_RATE'] or when a staff
+    user adds ?__profile=1 (optionally ?__profile=sample for the stack sampler).
+    Profiles go to a bounded directory and can be listed/downloaded via /api/profiles/.
+    When PROFILING['ENABLED'] is off the middleware removes itself at startup, so it
+    costs nothing per request.
+    """
+
+    def __init__(self, get_response):
+        config = profiling_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = float(config['SAMPLE_RATE'])
+        self.default_mode = config['MODE']
+        self.directory = config['DIR']
+        self.max_files = int(config['MAX_FILES'])
+        self.interval = float(config['SAMPLE_INTERVAL'])
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        mode = self._mode_for(request)
+        if mode is None:
+            return self.get_response(request)
+
+        name = self._profile_name(request, 'prof' if mode == 'cprofile' else 'folded')
+        path = os.path.join(self.directory, name)
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+                profiler.dump_stats(path)
+        else:
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+                sampler.dump(path)
+
+        self._prune()
+        response['X-Profile-ID'] = name
+        return response
+
+    def _mode_for(self, request):
+        trigger = request.GET.get('__profile')
+        if trigger and getattr(request, 'user', None) is not None and request.user.is_staff:
+            return 'sample' if trigger == 'sample' else self.default_mode
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return self.default_mode
+        return None
+
+    @staticmethod
+    def _profile_name(request, ext):
+        slug = re.sub(r'[^a-z0-9]+', '_', request.path.lower()).strip('_')[:40] or 'root'
+        return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}_{slug}_{uuid.uuid4().hex[:8]}.{ext}"
+
+    def _prune(self):
+        """Keep only the newest MAX_FILES profiles"""
+        profiles = list_profiles(self.directory)
+        for profile in profiles[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, profile['name']))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(directory=None):
+    """Stored profiles, newest first"""
+    directory = directory or profiling_config()['DIR']
+    try:
+        entries = [entry for entry in os.scandir(directory) if PROFILE_NAME_RE.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for entry in entries:
+        stat = entry.stat()
+        profiles.append({'name': entry.name, 'size': stat.st_size, 'created': stat.st_mtime})
+    profiles.sort(key=lambda profile: profile['created'], reverse=True)
+    return profiles
+
+
+def profile_path(name):
+    """Path of a stored profile, None for unknown or malformed names"""
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(profiling_config()['DIR'], name)
+    return path if os.path.exists(path) else None
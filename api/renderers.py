@@ -0,0 +1,42 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from .tracing import span
+
+
+class FastJSONRenderer(BaseRenderer):
+    """
+    Compact JSON renderer for hot endpoints
+    Skips the browsable API and passes already-encoded payloads (bytes) straight through,
+    so cached responses are never serialized twice
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    @staticmethod
+    def encode(data):
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return bytes(data)
+        with span('serialization'):
+            return self.encode(data)
+
+
+class BinaryRenderer(BaseRenderer):
+    """Raw bytes, selected with ?format=bin or Accept: application/octet-stream"""
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return bytes(data)
+        # Errors are still reported as JSON
+        return FastJSONRenderer.encode(data)
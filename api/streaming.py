@@ -0,0 +1,185 @@
+import logging
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .download_profile import DownloadProfile
+from .track_store import get_track_store
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PipedTranscode:
+    """
+    yt-dlp -> FFmpeg -> client, with no intermediate files
+
+    yt-dlp writes the source audio to stdout, FFmpeg reads it from stdin and writes MP3
+    to stdout, and every encoded chunk is relayed to the client as soon as it's read.
+    Time to first byte is therefore bounded by the first encoded frame, not by the
+    whole download plus transcode. The output is also teed into the track store so the
+    next request for the same track is served from disk.
+
+    Closing the iterator early (client went away) kills both subprocesses.
+    Admission and outcome go through the 'youtube.download' circuit breaker; a client
+    abort is not counted as an upstream failure but still gives the admitted slot back.
+    """
+
+    cache_suffix = '.mp3'
+
+    def __init__(self, url, video_id=None, profile=None):
+        self.url = url
+        self.video_id = video_id
+        self.profile = profile or DownloadProfile.from_settings()
+        self.bytes_sent = 0
+        self._processes = []
+        self._admitted = False
+        self._stream = None
+
+    def cached_path(self):
+        """Path of a previously completed transcode of this track, or None"""
+        store = get_track_store()
+        if store.exists(self.video_id, self.cache_suffix):
+            store.touch(self.video_id, self.cache_suffix)
+            return store.path(self.video_id, self.cache_suffix)
+        return None
+
+    def _source_command(self):
+        command = [
+            sys.executable, '-m', 'yt_dlp',
+            '--quiet', '--no-warnings', '--no-progress', '--no-part',
+            '-f', 'bestaudio/best',
+            '-N', str(self.profile.concurrent_fragments),
+            '--buffer-size', str(self.profile.buffer_size),
+            '--socket-timeout', str(getattr(settings, 'PIPE_SOCKET_TIMEOUT', 20)),
+        ]
+        if self.profile.http_chunk_size:
+            command += ['--http-chunk-size', str(self.profile.http_chunk_size)]
+        return command + ['-o', '-', '--', self.url]
+
+    def _encoder_command(self):
+        return [
+            'ffmpeg', '-nostdin', '-v', 'error',
+            '-i', 'pipe:0',
+            '-vn', '-c:a', 'libmp3lame', '-b:a', f'{self.profile.audio_quality}k',
+            '-f', 'mp3',
+            # Flush every encoded packet instead of buffering output
+            '-flush_packets', '1',
+            'pipe:1',
+        ]
+
+    def start(self):
+        source = subprocess.Popen(self._source_command(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._processes.append(source)
+        encoder = subprocess.Popen(
+            self._encoder_command(),
+            stdin=source.stdout,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._processes.append(encoder)
+        # Only the encoder holds the read end now, so yt-dlp sees EPIPE if FFmpeg dies
+        source.stdout.close()
+        return encoder
+
+    def admit(self):
+        """Reserve a call on the download breaker, raises CircuitOpenError when it's open"""
+        breaker = get_breaker('youtube.download')
+        if not breaker.allow_request():
+            raise CircuitOpenError(breaker.name, breaker.retry_after())
+        self._admitted = True
+
+    def _settle(self, outcome, elapsed=None):
+        """Report the admitted call's outcome to the breaker, exactly once"""
+        if not self._admitted:
+            return
+        self._admitted = False
+        breaker = get_breaker('youtube.download')
+        if outcome == 'success':
+            breaker.record_success(elapsed)
+        elif outcome == 'failure':
+            breaker.record_failure(elapsed)
+        else:
+            # Client went away or the response was never sent: no verdict on the upstream,
+            # but the slot must be given back or a half-open breaker stays stuck
+            breaker.release()
+
+    def __iter__(self):
+        self._stream = self._relay()
+        return self._stream
+
+    def close(self):
+        """Called by Django when the response is closed, iterated or not"""
+        if self._stream is not None:
+            self._stream.close()
+        self._settle('aborted')
+
+    def _relay(self):
+        started = time.monotonic()
+        try:
+            encoder = self.start()
+        except FileNotFoundError:
+            self._terminate()
+            self._settle('failure')
+            raise RuntimeError('ffmpeg not found')
+
+        store = get_track_store()
+        tee = store.open_atomic(self.video_id, self.cache_suffix) if store.is_valid_id(self.video_id) else None
+        completed = False
+        outcome = 'aborted'
+        try:
+            while True:
+                chunk = encoder.stdout.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if tee is not None:
+                    tee.file.write(chunk)
+                self.bytes_sent += len(chunk)
+                yield chunk
+            completed = self._wait() and self.bytes_sent > 0
+            outcome = 'success' if completed else 'failure'
+        except Exception:
+            outcome = 'failure'
+            raise
+        finally:
+            self._settle(outcome, time.monotonic() - started)
+            if not completed:
+                self._terminate()
+            if tee is not None:
+                # Only a complete transcode replaces the cache file
+                if completed:
+                    tee.commit()
+                else:
+                    tee.discard()
+            logger.info('piped transcode finished' if completed else 'piped transcode aborted', extra={
+                'video_id': self.video_id,
+                'bytes': self.bytes_sent,
+            })
+
+    def _wait(self):
+        """Reap both processes, True if both exited cleanly"""
+        ok = True
+        for name, process in zip(('yt-dlp', 'ffmpeg'), self._processes):
+            _, stderr = process.communicate()
+            if process.returncode != 0:
+                ok = False
+                logger.error('piped transcode process failed', extra={
+                    'subprocess': name,
+                    'returncode': process.returncode,
+                    'stderr': stderr.decode('utf-8', 'replace').strip()[:200],
+                })
+        return ok
+
+    def _terminate(self):
+        for process in self._processes:
+            if process.poll() is None:
+                process.kill()
+        for process in self._processes:
+            try:
+                process.communicate(timeout=5)
+            except (subprocess.TimeoutExpired, ValueError):
+                pass
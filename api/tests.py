@@ -1,3 +1,566 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import SimpleTestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from yt_dlp.utils import DownloadError, ExtractorError
+
+from . import metadata
+from .audio_analysis import AnalysisError, LoudnessAnalyzer, iter_pcm
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, get_breaker, is_upstream_failure
+from .http_client import DNSCache, build_client, http_client_config
+from .streaming import PipedTranscode
+from .throttling import TokenBucketThrottle
+from .track_store import TrackStore
+from .views import PreviewView, VideoResolveView, WaveformView, YouTubeDownloadView, YouTubeThumbnailView, is_thumbnail_url
+from .waveform import BASE_SAMPLES_PER_BIN, META_SUFFIX, MIN_LEVEL_BINS, PEAKS_SUFFIX, build_pyramid, select_level
+from .youtube_search import SearchResult
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('api.circuit_breaker.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=2, recovery_timeout=30.0, default_timeout=5.0)
+
+    def fail(self, error=None):
+        def func(timeout=None):
+            raise error or RuntimeError('upstream down')
+        with self.assertRaises(Exception):
+            self.breaker.call(func)
+
+    def succeed(self, seconds=0.0):
+        def func(timeout=None):
+            self.clock.now += seconds
+            return 'ok'
+        return self.breaker.call(func)
+
+    def test_opens_after_threshold_and_rejects(self):
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.succeed()
+        self.assertEqual(self.breaker.retry_after(), 30.0)
+
+    def test_half_open_trial_closes_or_reopens(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.clock.now += 30
+        self.assertEqual(self.succeed(), 'ok')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_admits_limited_trial_calls(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_release_frees_half_open_slot(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.release()
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_content_errors_do_not_count(self):
+        for _ in range(5):
+            self.fail(DownloadError('ERROR: [youtube] abcdefghijk: Video unavailable'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.snapshot()['ignored'], 5)
+
+    def test_content_error_closes_half_open(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 30
+        self.fail(ExtractorError('Private video. Sign in if you have been granted access', expected=True))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_custom_failure_predicate(self):
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.breaker.call(lambda timeout=None: int('x'), is_failure=lambda error: False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_success(self):
+        self.succeed(seconds=10)
+        self.succeed(seconds=10)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        breaker = CircuitBreaker('download', failure_threshold=1, default_timeout=5.0, slow_call_is_failure=False)
+        breaker.call(lambda timeout=None: setattr(self.clock, 'now', self.clock.now + 10))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_is_upstream_failure(self):
+        self.assertTrue(is_upstream_failure(RuntimeError('connection reset')))
+        self.assertTrue(is_upstream_failure(DownloadError("Sign in to confirm you're not a bot")))
+        self.assertFalse(is_upstream_failure(DownloadError('ERROR: Unsupported URL: https://example.com/')))
+        self.assertFalse(is_upstream_failure(DownloadError('This video has been removed by the uploader')))
+
+
+@override_settings(RATE_LIMIT={'ENABLED': False})
+class UpstreamURLTests(SimpleTestCase):
+    """Client-supplied URLs that aren't YouTube's must never reach the shared breakers"""
+
+    def calls(self, name):
+        return get_breaker(name).snapshot()['calls']
+
+    def test_non_youtube_download_url_is_rejected(self):
+        view = YouTubeDownloadView.as_view()
+        before = self.calls('youtube.extract')
+        for mode in ('', 'pipe'):
+            request = APIRequestFactory().get('/api/download/', {'url': 'http://127.0.0.1:9/x', 'mode': mode})
+            self.assertEqual(view(request).status_code, 400)
+        request = APIRequestFactory().post('/api/download/', {'url': 'http://127.0.0.1:9/x', 'async': 1}, format='json')
+        self.assertEqual(view(request).status_code, 400)
+        self.assertEqual(self.calls('youtube.extract'), before)
+        self.assertEqual(get_breaker('youtube.extract').state, CircuitBreaker.CLOSED)
+
+    def test_canonical_url_is_downloaded(self):
+        with mock.patch.object(YouTubeDownloadView, '_download_audio', return_value=HttpResponse()) as download:
+            request = APIRequestFactory().get('/api/download/', {'url': 'https://youtu.be/abcdefghijk?t=3'})
+            YouTubeDownloadView.as_view()(request)
+        download.assert_called_once_with('https://www.youtube.com/watch?v=abcdefghijk')
+
+    def test_non_youtube_preview_url_is_rejected(self):
+        before = self.calls('youtube.extract')
+        request = APIRequestFactory().get('/api/preview/', {'url': 'http://127.0.0.1:9/x', 'start': 10})
+        self.assertEqual(PreviewView.as_view()(request).status_code, 400)
+        self.assertEqual(self.calls('youtube.extract'), before)
+
+        with mock.patch('api.views.build_preview', side_effect=CircuitOpenError('youtube.extract', 1)) as build:
+            request = APIRequestFactory().get('/api/preview/', {'url': 'https://youtu.be/abcdefghijk', 'start': 12})
+            self.assertEqual(PreviewView.as_view()(request).status_code, 503)
+        build.assert_called_once_with('https://www.youtube.com/watch?v=abcdefghijk', 'abcdefghijk', 10.0, mock.ANY)
+
+    def test_non_youtube_thumbnail_url_is_rejected(self):
+        before = self.calls('youtube.thumbnail')
+        for url in ('http://127.0.0.1:9/x.jpg', 'https://example.com/vi/x.jpg', 'https://i.ytimg.com.evil.test/a.jpg'):
+            request = APIRequestFactory().get('/api/thumbnail/', {'url': url})
+            self.assertEqual(YouTubeThumbnailView.as_view()(request).status_code, 400)
+        self.assertEqual(self.calls('youtube.thumbnail'), before)
+
+    def test_is_thumbnail_url(self):
+        self.assertTrue(is_thumbnail_url('https://i.ytimg.com/vi/abcdefghijk/hqdefault.jpg'))
+        self.assertTrue(is_thumbnail_url('https://yt3.ggpht.com/a/photo.jpg'))
+        self.assertFalse(is_thumbnail_url('https://i.ytimg.com:8443/vi/x.jpg'))
+        self.assertFalse(is_thumbnail_url('https://user@i.ytimg.com/vi/x.jpg'))
+        self.assertFalse(is_thumbnail_url('ftp://i.ytimg.com/vi/x.jpg'))
+        self.assertFalse(is_thumbnail_url('https://notytimg.com/vi/x.jpg'))
+
+
+class PipedTranscodeBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('youtube.download', failure_threshold=1, recovery_timeout=0.0)
+        patcher = mock.patch('api.streaming.get_breaker', return_value=self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Open, then half-open straight away (recovery_timeout=0)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def transcode(self, *commands):
+        transcode = PipedTranscode('https://youtu.be/abcdefghijk', video_id=None)
+        transcode._source_command = lambda: commands[0]
+        transcode._encoder_command = lambda: commands[1]
+        return transcode
+
+    def test_unsent_response_releases_slot(self):
+        transcode = self.transcode(['true'], ['cat'])
+        transcode.admit()
+        self.assertFalse(self.breaker.allow_request())
+        transcode.close()
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_client_abort_releases_slot(self):
+        transcode = self.transcode(['yes'], ['cat'])
+        transcode.admit()
+        stream = iter(transcode)
+        next(stream)
+        transcode.close()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_completed_stream_closes_breaker(self):
+        transcode = self.transcode(['echo', 'audio'], ['cat'])
+        transcode.admit()
+        self.assertEqual(b''.join(transcode), b'audio\n')
+        transcode.close()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_process_records_failure(self):
+        transcode = self.transcode(['false'], ['cat'])
+        transcode.admit()
+        with self.assertLogs('api.streaming', level='ERROR') as logs:
+            self.assertEqual(b''.join(transcode), b'')
+        transcode.close()
+        self.assertEqual(logs.records[0].subprocess, 'yt-dlp')
+        self.assertEqual(self.breaker.snapshot()['failures'], 2)
+
+
+class BulkResolveTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = TrackStore(tmp.name)
+        patcher = mock.patch('api.metadata.get_track_store', return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metadata.remember([self.result('aaaaaaaaaaa')])
+
+    @staticmethod
+    def result(video_id):
+        return SearchResult(video_id, f'title {video_id}', '', 'channel', 60)
+
+    def test_misses_are_capped(self):
+        resolver = metadata.BulkResolver(['aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc', 'nope'], max_misses=1)
+        with mock.patch('api.metadata.resolve_one', side_effect=self.result) as resolve_one:
+            lines = [json.loads(line) for line in resolver]
+        resolve_one.assert_called_once_with('bbbbbbbbbbb')
+        self.assertEqual(resolver.misses, 1)
+        by_id = {line.get('id', line.get('input')): line for line in lines}
+        self.assertEqual(by_id['aaaaaaaaaaa']['source'], 'store')
+        self.assertEqual(by_id['bbbbbbbbbbb']['source'], 'upstream')
+        self.assertTrue(by_id['ccccccccccc']['deferred'])
+        self.assertIn('error', by_id['nope'])
+
+    def test_remember_skips_fresh_entries(self):
+        with mock.patch.object(self.store, 'write_json') as write_json:
+            metadata.remember([self.result('aaaaaaaaaaa'), self.result('bbbbbbbbbbb')])
+        write_json.assert_called_once()
+        self.assertEqual(write_json.call_args.args[0], 'bbbbbbbbbbb')
+
+        path = self.store.path('aaaaaaaaaaa', metadata.SUFFIX)
+        os.utime(path, (0, 0))
+        with mock.patch.object(self.store, 'write_json') as write_json:
+            metadata.remember([self.result('aaaaaaaaaaa')])
+        write_json.assert_called_once()
+
+    @override_settings(VIDEO_RESOLVE_MAX_MISSES=2, RATE_LIMIT={'COSTS': {'resolve': 2, 'resolve_miss': 1}})
+    def test_throttle_cost_scales_with_misses(self):
+        ids = ['aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc', 'ddddddddddd']
+        request = VideoResolveView().initialize_request(
+            APIRequestFactory().post('/api/videos/resolve/', {'ids': ids}, format='json'))
+        # Two of the three uncached IDs are extracted, the third is deferred
+        self.assertEqual(VideoResolveView().throttle_cost(request, 2), 4)
+
+        bad = VideoResolveView().initialize_request(
+            APIRequestFactory().post('/api/videos/resolve/', {'ids': 'x'}, format='json'))
+        self.assertEqual(VideoResolveView().throttle_cost(bad, 2), 2)
+
+
+class TokenBucketThrottleTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        # Refill is slow enough that no tokens come back during a test
+        self.settings_override = override_settings(RATE_LIMIT={
+            'DB_PATH': os.path.join(tmp.name, 'ratelimit.sqlite3'),
+            'CAPACITY': 4,
+            'REFILL_PER_SECOND': 0.001,
+            'COSTS': {'thumbnail': 1, 'search': 2, 'metrics': 0},
+            'API_KEYS': frozenset({'trusted-key'}),
+        })
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def statuses(self, count, **headers):
+        """Status codes of `count` thumbnail requests (400 = let through, rejected URL)"""
+        return [
+            self.client.get('/api/thumbnail/', {'url': 'x'}, REMOTE_ADDR='10.0.0.1', **headers).status_code
+            for _ in range(count)
+        ]
+
+    def test_keyed_by_remote_addr(self):
+        self.assertEqual(self.statuses(5), [400] * 4 + [429])
+        response = self.client.get('/api/thumbnail/', {'url': 'x'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rotating_forwarded_for_shares_bucket(self):
+        codes = [
+            self.client.get('/api/thumbnail/', {'url': 'x'}, REMOTE_ADDR='10.0.0.1',
+                            HTTP_X_FORWARDED_FOR=f'192.0.2.{i}').status_code
+            for i in range(5)
+        ]
+        self.assertEqual(codes, [400] * 4 + [429])
+
+    def test_forwarded_for_trusted_behind_configured_proxy(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            self.assertEqual(self.statuses(5, HTTP_X_FORWARDED_FOR='192.0.2.1'), [400] * 4 + [429])
+            # Another client behind the same proxy has its own bucket
+            self.assertEqual(self.statuses(1, HTTP_X_FORWARDED_FOR='192.0.2.2'), [400])
+
+    def test_only_allow_listed_api_keys_get_own_bucket(self):
+        self.assertEqual(self.statuses(2, HTTP_X_API_KEY='made-up-1'), [400] * 2)
+        self.assertEqual(self.statuses(3, HTTP_X_API_KEY='made-up-2'), [400] * 2 + [429])
+        self.assertEqual(self.statuses(4, HTTP_X_API_KEY='trusted-key'), [400] * 4)
+
+    def allow(self, scope, **view_attrs):
+        request = Request(APIRequestFactory().get('/', REMOTE_ADDR='10.0.0.9'))
+        throttle = TokenBucketThrottle()
+        allowed = throttle.allow_request(request, SimpleNamespace(throttle_scope=scope, **view_attrs))
+        return allowed, getattr(request._request, 'rate_limit', None), throttle
+
+    def test_scope_costs(self):
+        allowed, rate_limit, _ = self.allow('search')
+        self.assertTrue(allowed)
+        self.assertEqual((rate_limit['cost'], rate_limit['remaining']), (2, 2))
+        self.assertTrue(self.allow('search')[0])
+        allowed, _, throttle = self.allow('search')
+        self.assertFalse(allowed)
+        self.assertEqual(throttle.wait(), 2000)
+
+        # Free scopes skip the bucket entirely
+        allowed, rate_limit, _ = self.allow('metrics')
+        self.assertTrue(allowed)
+        self.assertIsNone(rate_limit)
+
+    def test_view_cost_hook_is_capped_at_capacity(self):
+        allowed, rate_limit, _ = self.allow('search', throttle_cost=lambda request, cost: cost * 100)
+        self.assertTrue(allowed)
+        self.assertEqual((rate_limit['cost'], rate_limit['remaining']), (4, 0))
+
+    def test_rate_limit_headers(self):
+        response = self.client.get('/api/thumbnail/', {'url': 'x'}, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response['X-RateLimit-Limit'], '4')
+        self.assertEqual(response['X-RateLimit-Remaining'], '3')
+        self.assertEqual(response['X-RateLimit-Reset'], '1000')
+        self.assertEqual(response['X-RateLimit-Cost'], '1')
+
+        self.statuses(3)
+        response = self.client.get('/api/thumbnail/', {'url': 'x'}, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1000')
+        self.assertEqual(response['X-RateLimit-Remaining'], '0')
+
+
+class HTTPClientTests(SimpleTestCase):
+    def test_retry_after_is_capped_by_deadline(self):
+        hits = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                self.send_response(429)
+                self.send_header('Retry-After', '3600')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        client = build_client({**http_client_config(), 'RETRY_MAX_SLEEP': 0.2})
+        started = time.monotonic()
+        response = client.get(f'http://127.0.0.1:{server.server_port}/', timeout=5)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(hits), 3)
+        self.assertLess(time.monotonic() - started, 2)
+
+        hits.clear()
+        started = time.monotonic()
+        response = build_client().get(f'http://127.0.0.1:{server.server_port}/', timeout=0.5)
+        self.assertEqual(response.status_code, 429)
+        # The deadline ends the retries long before the 2 s sleep cap
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_dns_cache_is_bounded(self):
+        clock = Clock()
+        cache = DNSCache(ttl=10, max_entries=2)
+        cache._getaddrinfo = lambda host, *args: [(host,)]
+        with mock.patch('api.http_client.time.monotonic', clock):
+            cache.getaddrinfo('a.test', 443)
+            cache.getaddrinfo('b.test', 443)
+            cache.getaddrinfo('c.test', 443)
+            self.assertEqual([key[0] for key in cache._entries], ['b.test', 'c.test'])
+
+            clock.now += 11
+            cache.getaddrinfo('d.test', 443)
+            self.assertEqual([key[0] for key in cache._entries], ['d.test'])
+            self.assertEqual(cache.getaddrinfo('d.test', 443), [('d.test',)])
+            self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+
+def sine(seconds, dbfs=0.0, frequency=1000, sample_rate=48000):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (10 ** (dbfs / 20) * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+class LoudnessAnalyzerTests(SimpleTestCase):
+    def measure(self, pcm, chunk=None):
+        analyzer = LoudnessAnalyzer()
+        for offset in range(0, len(pcm), chunk or len(pcm)):
+            analyzer.feed(pcm[offset:offset + (chunk or len(pcm))])
+        return analyzer.result()
+
+    def test_reference_tones(self):
+        tone = sine(10)
+        silence = np.zeros_like(tone)
+        result = self.measure(np.stack([tone, tone], axis=1))
+        self.assertAlmostEqual(result['integrated_lufs'], 0.0, delta=0.05)
+        self.assertAlmostEqual(result['peak_dbfs'], 0.0, delta=0.01)
+        self.assertEqual(result['replaygain_track_gain'], round(-18.0 - result['integrated_lufs'], 2))
+        # One channel carries half the energy
+        result = self.measure(np.stack([tone, silence], axis=1))
+        self.assertAlmostEqual(result['integrated_lufs'], -3.0, delta=0.05)
+
+    def test_chunking_does_not_change_result(self):
+        tone = sine(3, dbfs=-12)
+        pcm = np.stack([tone, tone], axis=1)
+        self.assertEqual(self.measure(pcm), self.measure(pcm, chunk=12345))
+
+    def test_silence_is_gated(self):
+        tone = sine(10, dbfs=-23)
+        pcm = np.concatenate((np.zeros((len(tone), 2), dtype=np.float32), np.stack([tone, tone], axis=1)))
+        result = self.measure(pcm, chunk=48000)
+        self.assertAlmostEqual(result['integrated_lufs'], -23.0, delta=0.1)
+        self.assertEqual(result['duration'], 20.0)
+
+    def test_quiet_passage_below_relative_gate(self):
+        loud, quiet = sine(10, dbfs=-20), sine(10, dbfs=-40)
+        pcm = np.stack([np.concatenate((loud, quiet))] * 2, axis=1)
+        self.assertAlmostEqual(self.measure(pcm)['integrated_lufs'], -20.0, delta=0.1)
+
+    def test_all_silence_and_no_audio(self):
+        result = self.measure(np.zeros((48000, 2), dtype=np.float32))
+        self.assertIsNone(result['integrated_lufs'])
+        self.assertIsNone(result['replaygain_track_gain'])
+        with self.assertRaises(AnalysisError):
+            LoudnessAnalyzer().result()
+
+
+class IterPCMTests(SimpleTestCase):
+    def decoder(self, script):
+        """Stand-in for ffmpeg: run `script` with the same pipes"""
+        popen = subprocess.Popen
+        return mock.patch('api.audio_analysis.subprocess.Popen', lambda command, **kwargs: popen(['sh', '-c', script], **kwargs))
+
+    def test_chunks_are_whole_frames(self):
+        samples = np.arange(6, dtype='<f4')
+        with tempfile.NamedTemporaryFile() as raw:
+            raw.write(samples.tobytes())
+            raw.flush()
+            with self.decoder(f'cat {raw.name}'):
+                chunks = list(iter_pcm('track.mp3', sample_rate=1, chunk_seconds=1))
+        self.assertEqual([chunk.shape for chunk in chunks], [(1, 2)] * 3)
+        np.testing.assert_array_equal(np.concatenate(chunks).ravel(), samples)
+
+    def test_decode_failure(self):
+        with self.decoder('echo "track.mp3: Invalid data found when processing input" >&2; exit 1'):
+            with self.assertRaisesRegex(AnalysisError, 'Invalid data found'):
+                list(iter_pcm('track.mp3'))
+
+    def test_missing_ffmpeg(self):
+        with mock.patch('api.audio_analysis.subprocess.Popen', side_effect=FileNotFoundError):
+            with self.assertRaisesRegex(AnalysisError, 'ffmpeg not found'):
+                list(iter_pcm('track.mp3'))
+
+
+class WaveformTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        low = rng.integers(-32767, 0, 1000)
+        self.base = np.stack((low, low + rng.integers(0, 32767, 1000)), axis=1).astype(np.int16)
+        self.pyramid, self.levels = build_pyramid(self.base)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'peaks.npy')
+        np.save(self.path, self.pyramid)
+        self.mapped = np.load(self.path, mmap_mode='r')
+
+    def test_pyramid_levels(self):
+        self.assertEqual([bins for _, bins, _ in self.levels], [1000, 500, 250, 125, 63, 32])
+        self.assertEqual([spb for _, _, spb in self.levels], [BASE_SAMPLES_PER_BIN * 2 ** i for i in range(6)])
+        offset, bins, _ = self.levels[1]
+        half = self.pyramid[offset:offset + bins]
+        np.testing.assert_array_equal(half[:, 0], self.base[:, 0].reshape(-1, 2).min(axis=1))
+        np.testing.assert_array_equal(half[:, 1], self.base[:, 1].reshape(-1, 2).max(axis=1))
+        self.assertEqual(len(self.pyramid), sum(bins for _, bins, _ in self.levels))
+
+    def test_exact_level_is_a_view(self):
+        peaks, samples_per_bin = select_level(self.mapped, self.levels, 250)
+        self.assertEqual((len(peaks), samples_per_bin), (250, 4 * BASE_SAMPLES_PER_BIN))
+        self.assertTrue(np.shares_memory(peaks, self.mapped))
+        self.assertIsInstance(peaks, np.memmap)
+
+    def test_between_levels_reduces_next_finer_level(self):
+        peaks, samples_per_bin = select_level(self.mapped, self.levels, 300)
+        self.assertEqual(peaks.shape, (300, 2))
+        self.assertAlmostEqual(samples_per_bin, 2 * BASE_SAMPLES_PER_BIN * 500 / 300)
+        self.assertFalse(np.shares_memory(peaks, self.mapped))
+        self.assertEqual(peaks[:, 0].min(), self.base[:, 0].min())
+        self.assertEqual(peaks[:, 1].max(), self.base[:, 1].max())
+
+    def test_below_min_level_reduces_coarsest_level(self):
+        peaks, samples_per_bin = select_level(self.mapped, self.levels, 10)
+        self.assertEqual(peaks.shape, (10, 2))
+        self.assertAlmostEqual(samples_per_bin, 32 * BASE_SAMPLES_PER_BIN * MIN_LEVEL_BINS / 10)
+
+    def test_above_base_returns_base_level(self):
+        peaks, samples_per_bin = select_level(self.mapped, self.levels, 5000)
+        self.assertEqual((len(peaks), samples_per_bin), (1000, BASE_SAMPLES_PER_BIN))
+        np.testing.assert_array_equal(peaks, self.base)
+
+    @override_settings(RATE_LIMIT={'ENABLED': False})
+    def test_view_binary_and_json(self):
+        store = TrackStore(os.path.dirname(self.path))
+        video_id = 'abcdefghijk'
+        with store.open_atomic(video_id, PEAKS_SUFFIX) as f:
+            np.save(f, self.pyramid)
+        # Levels come back from JSON as lists, like they do in production
+        store.write_json(video_id, META_SUFFIX, {'levels': self.levels, 'sample_rate': 48000, 'duration': 5.33})
+
+        view = WaveformView.as_view()
+        with mock.patch('api.views.get_track_store', return_value=store):
+            response = view(APIRequestFactory().get('/api/waveform/', {'id': video_id, 'resolution': 250, 'format': 'bin'}))
+            response.render()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/octet-stream')
+            self.assertEqual(response['X-Waveform-Bins'], '250')
+            self.assertEqual(response['X-Waveform-Seconds-Per-Bin'], f'{4 * BASE_SAMPLES_PER_BIN / 48000:.6f}')
+            offset, bins, _ = self.levels[2]
+            payload = np.frombuffer(response.content, dtype='<i2').reshape(-1, 2)
+            np.testing.assert_array_equal(payload, self.pyramid[offset:offset + bins])
+
+            response = view(APIRequestFactory().get('/api/waveform/', {'id': video_id, 'resolution': 250}))
+            response.render()
+            data = json.loads(response.content)
+            self.assertEqual((data['bins'], data['duration']), (250, 5.33))
+            self.assertEqual(data['peaks'], payload.ravel().tolist())
+
+            response = view(APIRequestFactory().get('/api/waveform/', {'id': 'zzzzzzzzzzz'}))
+            self.assertEqual(response.status_code, 404)
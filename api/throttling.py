@@ -0,0 +1,178 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+class SQLiteTokenBucketStore:
+    """
+    Token buckets kept in a local SQLite file
+    Every gunicorn worker opens the same file, so limits hold across processes.
+    Each consume() is a single BEGIN IMMEDIATE transaction, which serializes
+    concurrent updates to a bucket without any extra locking.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS buckets ('
+        'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._next_purge = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Limiter state is disposable, don't pay for fsync on every request
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key, cost, capacity, refill_rate, now=None):
+        """
+        Take `cost` tokens from the bucket for `key`
+        Returns (allowed, remaining_tokens, seconds_until_enough_tokens)
+        """
+        now = time.time() if now is None else now
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, row[0] + (now - row[1]) * refill_rate)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                (key, tokens, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        wait = 0.0 if allowed else (cost - tokens) / refill_rate
+        return allowed, tokens, wait
+
+    def purge(self, older_than):
+        """Drop buckets untouched since `older_than` (they would be full again anyway)"""
+        self._connection().execute('DELETE FROM buckets WHERE updated < ?', (older_than,))
+
+    def maybe_purge(self, older_than, interval, now=None):
+        """purge() at most once per `interval` seconds in this process"""
+        now = time.time() if now is None else now
+        if now < self._next_purge:
+            return
+        self._next_purge = now + interval
+        self.purge(older_than)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path):
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = SQLiteTokenBucketStore(path)
+        return store
+
+
+def rate_limit_config():
+    return {
+        'ENABLED': True,
+        'DB_PATH': os.path.join(os.environ.get('TMPDIR', '/tmp'), 'ratelimit.sqlite3'),
+        'CAPACITY': 60,
+        'REFILL_PER_SECOND': 1.0,
+        'COSTS': {},
+        'API_KEY_HEADER': 'HTTP_X_API_KEY',
+        'API_KEYS': (),
+        'PURGE_INTERVAL': 300,
+        **getattr(settings, 'RATE_LIMIT', {}),
+    }
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Per-client token bucket shared across workers
+    Clients are identified by API key (X-API-Key) when it's a configured key, otherwise by IP.
+    X-Forwarded-For is only trusted as far as REST_FRAMEWORK['NUM_PROXIES'] allows.
+    Each view spends settings.RATE_LIMIT['COSTS'][view.throttle_scope] tokens per request,
+    so heavy endpoints (download) drain the bucket much faster than cheap ones (thumbnail).
+    Views whose work depends on the request body can define throttle_cost(request, cost)
+    to adjust that per request; the result is capped at the bucket capacity.
+    """
+
+    def allow_request(self, request, view):
+        config = rate_limit_config()
+        if not config['ENABLED']:
+            return True
+
+        scope = getattr(view, 'throttle_scope', None) or 'default'
+        cost = config['COSTS'].get(scope, 1)
+        if cost <= 0:
+            return True
+
+        capacity = config['CAPACITY']
+        refill_rate = config['REFILL_PER_SECOND']
+        if hasattr(view, 'throttle_cost'):
+            cost = min(view.throttle_cost(request, cost), capacity)
+        store = get_store(config['DB_PATH'])
+        allowed, remaining, wait = store.consume(self.get_client_key(request, config), cost, capacity, refill_rate)
+        # A bucket idle for capacity / refill_rate seconds is full again, its row can go
+        store.maybe_purge(time.time() - capacity / refill_rate, config['PURGE_INTERVAL'])
+        self.wait_seconds = wait
+
+        # Picked up by RateLimitHeadersMiddleware to emit X-RateLimit-* headers
+        request._request.rate_limit = {
+            'limit': capacity,
+            'remaining': int(remaining),
+            'reset': math.ceil((capacity - remaining) / refill_rate),
+            'cost': cost,
+        }
+        return allowed
+
+    def get_client_key(self, request, config):
+        """
+        Bucket key for the client
+        Only API keys listed in RATE_LIMIT['API_KEYS'] get their own bucket; anything else
+        is keyed by IP, so inventing a new key per request doesn't buy a fresh bucket
+        """
+        api_key = request.META.get(config['API_KEY_HEADER'])
+        if api_key and api_key in config['API_KEYS']:
+            # Don't keep raw API keys in the limiter database
+            return 'key:' + hashlib.sha1(api_key.encode('utf-8')).hexdigest()
+        return f'ip:{self.get_ident(request)}'
+
+    def get_ident(self, request):
+        """
+        Client IP for the bucket key
+        Without NUM_PROXIES, DRF would key on the raw X-Forwarded-For header, which any
+        client can rotate to get a fresh bucket per request; fall back to REMOTE_ADDR instead
+        """
+        if api_settings.NUM_PROXIES is None:
+            return request.META.get('REMOTE_ADDR')
+        return super().get_ident(request)
+
+    def wait(self):
+        return math.ceil(getattr(self, 'wait_seconds', 0)) or None
@@ -0,0 +1,163 @@
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger('api.access')
+
+_current = ContextVar('api_request_trace', default=None)
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Categories reported in Server-Timing, in this order
+SPANS = ('extraction', 'network', 'transcode', 'serialization')
+
+# Pipeline stage -> Server-Timing category
+STAGE_SPANS = {
+    'resolve': 'extraction',
+    'fetch': 'network',
+    'postprocess': 'transcode',
+    'analyze': 'transcode',
+    'store': 'storage',
+    'serve': 'serialization',
+}
+
+
+class RequestTrace:
+    """Request ID, sampling decision and accumulated span durations of one request"""
+    __slots__ = ('request_id', 'sampled', 'spans', 'started')
+
+    def __init__(self, request_id, sampled):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.spans = {}
+        self.started = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def server_timing(self, total):
+        names = list(SPANS) + [name for name in self.spans if name not in SPANS]
+        parts = [f'{name};dur={self.spans[name] * 1000:.1f}' for name in names if name in self.spans]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def current_trace():
+    return _current.get()
+
+
+def add_span(name, seconds):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def span(name):
+    """Time a block and add it to the current request's Server-Timing breakdown"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+def _tracing_config():
+    return {'SAMPLE_RATE': 0.0, 'SERVER_TIMING': True, **getattr(settings, 'TRACING', {})}
+
+
+class TracingMiddleware:
+    """
+    Assigns every request an ID (honouring a well-formed incoming X-Request-ID),
+    collects span timings for a Server-Timing header and, for a sampled fraction of
+    requests, emits one structured access log line with the full breakdown
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = _tracing_config()
+        self.sample_rate = float(config['SAMPLE_RATE'])
+        self.server_timing = config['SERVER_TIMING']
+
+    def __call__(self, request):
+        incoming = request.META.get('HTTP_X_REQUEST_ID', '')
+        request_id = incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        trace = RequestTrace(request_id, sampled)
+        request.request_id = request_id
+        token = _current.set(trace)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = time.perf_counter() - trace.started
+        response['X-Request-ID'] = request_id
+        if self.server_timing:
+            response['Server-Timing'] = trace.server_timing(total)
+            # Lets browser clients on other origins read the breakdown
+            response['Timing-Allow-Origin'] = '*'
+        if sampled:
+            logger.info('request', extra={
+                'request_id': request_id,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(total * 1000, 1),
+                'spans_ms': {name: round(seconds * 1000, 1) for name, seconds in trace.spans.items()},
+            })
+        return response
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request ID to every log record"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            trace = _current.get()
+            record.request_id = trace.request_id if trace is not None else None
+        return True
+
+
+class SampledFilter(logging.Filter):
+    """
+    Drop INFO/DEBUG records of unsampled requests
+    Warnings and errors always pass, as does anything logged outside a request
+    """
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        trace = _current.get()
+        return trace is None or trace.sampled
+
+
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, request ID and any extra fields"""
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# A directory holding this file is being written (HLS transcode) and is never evicted,
+# unless the lock is older than this many seconds
+_BUSY_LOCK = '.transcoding'
+_BUSY_LOCK_MAX_AGE = 6 * 60 * 60
+
+
+class TrackStore:
+    """
+    Per-track artifacts (analysis results, waveform peaks, clips) kept on local disk
+    Files are named <video_id><suffix> and sharded by the first two characters of the ID
+
+    With `max_bytes` the store is bounded: once it grows past the limit, the least
+    recently used entries (files, or whole HLS directories) are evicted down to 90% of
+    it. Writes trigger the check; cache hits call touch() to count as a use.
+    """
+
+    def __init__(self, root, max_bytes=None, evict_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._written = 0
+        self._next_evict = 0.0
+        self._evict_lock = threading.Lock()
+
+    @staticmethod
+    def is_valid_id(video_id):
+        return bool(video_id) and bool(_VIDEO_ID_RE.match(video_id))
+
+    def path(self, video_id, suffix):
+        if not self.is_valid_id(video_id):
+            raise ValueError(f"Invalid video ID: {video_id!r}")
+        return os.path.join(self.root, video_id[:2], f'{video_id}{suffix}')
+
+    def exists(self, video_id, suffix):
+        return self.is_valid_id(video_id) and os.path.exists(self.path(video_id, suffix))
+
+    def read_json(self, video_id, suffix):
+        """Stored JSON document, or None if it doesn't exist"""
+        if not self.is_valid_id(video_id):
+            return None
+        try:
+            with open(self.path(video_id, suffix), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_json(self, video_id, suffix, data):
+        with self.open_atomic(video_id, suffix, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+
+    def open_atomic(self, video_id, suffix, mode='wb', **kwargs):
+        """File handle that only replaces the stored file once it is closed successfully"""
+        return _AtomicFile(self.path(video_id, suffix), mode, on_commit=self._committed, **kwargs)
+
+    def touch(self, video_id, suffix):
+        """Mark an entry as used, so LRU eviction keeps it longer"""
+        try:
+            os.utime(self.path(video_id, suffix))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def _committed(self, size):
+        self._written += size
+        # Check early when a lot was written since the last pass, otherwise at most once per interval
+        if self.max_bytes and self._written > self.max_bytes // 20:
+            self._next_evict = 0.0
+        self.maybe_evict()
+
+    def maybe_evict(self):
+        """Start an eviction pass in the background unless one ran recently or is running"""
+        if not self.max_bytes or time.monotonic() < self._next_evict:
+            return
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        self._next_evict = time.monotonic() + self.evict_interval
+        self._written = 0
+        threading.Thread(target=self._run_eviction, name='track-store-evict', daemon=True).start()
+
+    def _run_eviction(self):
+        try:
+            self.evict()
+        except OSError as e:
+            logger.warning('track store eviction failed', extra={'error': str(e)})
+        finally:
+            self._evict_lock.release()
+
+    def evict(self):
+        """Remove least recently used entries until the store is under 90% of max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, size, _, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+        target = self.max_bytes * 9 // 10
+        removed = 0
+        for _, size, path, busy in sorted(entries):
+            if total <= target:
+                break
+            if busy:
+                continue
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        logger.info('track store evicted', extra={'entries': removed, 'bytes_left': total})
+        return removed
+
+    def _entries(self):
+        """(last use, size, path, busy) of every entry; busy ones are counted but never evicted"""
+        entries = []
+        now = time.time()
+        try:
+            shards = [shard for shard in os.scandir(self.root) if shard.is_dir()]
+        except FileNotFoundError:
+            return entries
+        for shard in shards:
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.tmp_'):
+                    continue
+                if entry.is_dir():
+                    size, busy = self._dir_usage(entry.path, now)
+                    entries.append((entry.stat().st_mtime, size, entry.path, busy))
+                else:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path, False))
+        return entries
+
+    @staticmethod
+    def _dir_usage(path, now):
+        size = 0
+        busy = False
+        for entry in os.scandir(path):
+            stat = entry.stat()
+            size += stat.st_size
+            if entry.name == _BUSY_LOCK and now - stat.st_mtime < _BUSY_LOCK_MAX_AGE:
+                busy = True
+        return size, busy
+
+
+class _AtomicFile:
+    def __init__(self, path, mode, on_commit=None, **kwargs):
+        self.path = path
+        self.on_commit = on_commit
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+        self.file = os.fdopen(fd, mode, **kwargs)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        if self.on_commit is not None:
+            self.on_commit(os.path.getsize(self.path))
+
+    def discard(self):
+        self.file.close()
+        os.unlink(self.temp_path)
+
+
+_store = None
+
+
+def get_track_store():
+    global _store
+    root = getattr(settings, 'TRACK_STORE_DIR', os.path.join(tempfile.gettempdir(), 'track_store'))
+    if _store is None or _store.root != root:
+        _store = TrackStore(
+            root,
+            max_bytes=getattr(settings, 'TRACK_STORE_MAX_BYTES', None),
+            evict_interval=getattr(settings, 'TRACK_STORE_EVICT_INTERVAL', 60),
+        )
+    return _store
@@ -2,11 +2,33 @@ from django.urls import path
 from .views import (
     YouTubeThumbnailView,
     YouTubeSearchView,
-    YouTubeDownloadView
+    YouTubeDownloadView,
+    DownloadJobView,
+    VideoResolveView,
+    PreviewView,
+    HLSStartView,
+    HLSPlaylistView,
+    HLSSegmentView,
+    AudioAnalysisView,
+    WaveformView,
+    ProfileListView,
+    ProfileDownloadView,
+    MetricsView
 )
 
 urlpatterns = [
     path('search/', YouTubeSearchView.as_view(), name='youtube-search'),
     path('download/', YouTubeDownloadView.as_view(), name='youtube-download'),
+    path('download/jobs/<str:job_id>/', DownloadJobView.as_view(), name='youtube-download-job'),
+    path('videos/resolve/', VideoResolveView.as_view(), name='video-resolve'),
     path('thumbnail/', YouTubeThumbnailView.as_view(), name='youtube-thumbnail'),
+    path('preview/', PreviewView.as_view(), name='youtube-preview'),
+    path('hls/', HLSStartView.as_view(), name='hls-start'),
+    path('hls/<str:video_id>/playlist.m3u8', HLSPlaylistView.as_view(), name='hls-playlist'),
+    path('hls/<str:video_id>/<str:segment>', HLSSegmentView.as_view(), name='hls-segment'),
+    path('analysis/', AudioAnalysisView.as_view(), name='audio-analysis'),
+    path('waveform/', WaveformView.as_view(), name='waveform'),
+    path('profiles/', ProfileListView.as_view(), name='profile-list'),
+    path('profiles/<str:name>/', ProfileDownloadView.as_view(), name='profile-download'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -1,15 +1,20 @@
-import yt_dlp
+import logging
 import os
-import tempfile
 import shutil
 
+from .download_profile import DownloadProfile
+from .pipeline import DownloadPipeline, default_stages
+
+logger = logging.getLogger(__name__)
+
 class Video2Audio:
     """
-    Simple YouTube to Audio converter using yt-dlp
+    Simple YouTube to Audio converter built on the shared download pipeline
     Downloads temporarily, returns file path, caller is responsible for cleanup
     """
-    def __init__(self, video_url):
+    def __init__(self, video_url, profile=None):
         self.video_url = video_url
+        self.profile = profile or DownloadProfile.from_settings()
 
     def convert(self, output_dir=None):
         """
@@ -27,83 +32,31 @@ class Video2Audio:
                 'temp_dir': str    # Temp directory path (for cleanup)
             }
         """
-        temp_dir = None
         try:
-            print(f"🔗 Processing: {self.video_url}")
-
-            # Use provided output_dir or create temp directory
-            if output_dir:
-                os.makedirs(output_dir, exist_ok=True)
-                temp_dir = output_dir
-                is_temp = False
-            else:
-                temp_dir = tempfile.mkdtemp(prefix='video2audio_')
-                is_temp = True
-
-            output_template = os.path.join(temp_dir, '%(title)s.%(ext)s')
-
-            # yt-dlp options
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': output_template,
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'quiet': True,
-                'no_warnings': True,
-            }
-
-            # Download and extract info
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print("📝 Extracting video info...")
-                info = ydl.extract_info(self.video_url, download=True)
-
-                song_name = info.get('title', 'Unknown')
-                thumbnail_url = info.get('thumbnail')
-
-                print(f"📝 Title: {song_name}")
-
-            # Find the downloaded MP3 file
-            mp3_path = None
-            for file in os.listdir(temp_dir):
-                if file.endswith('.mp3'):
-                    mp3_path = os.path.join(temp_dir, file)
-                    break
-
-            if not mp3_path or not os.path.exists(mp3_path):
-                raise Exception("MP3 file not found after download")
-
-            file_size = os.path.getsize(mp3_path)
-            print(f"✓ Downloaded: {file_size} bytes ({file_size / 1024 / 1024:.2f} MB)")
+            logger.info('convert started', extra={'url': self.video_url})
 
-            if file_size == 0:
-                raise Exception("Downloaded MP3 file is empty")
+            pipeline = DownloadPipeline(stages=default_stages(serve=False))
+            ctx = pipeline.run(
+                self.video_url,
+                profile=self.profile,
+                output_dir=output_dir,
+                keep_file=True,
+            )
 
-            print(f"✓ Successfully downloaded: {song_name}")
+            logger.info('convert finished', extra={'video_id': ctx.video_id, 'title': ctx.title})
 
             return {
                 'success': True,
-                'file_path': mp3_path,
-                'title': song_name,
-                'size': file_size,
-                'thumbnail_url': thumbnail_url,
-                'temp_dir': temp_dir if is_temp else None
+                'file_path': ctx.file_path,
+                'title': ctx.title,
+                'size': ctx.size,
+                'thumbnail_url': ctx.info.get('thumbnail'),
+                'temp_dir': ctx.work_dir
             }
 
         except Exception as e:
-            print(f"✗ Error: {str(e)}")
-            import traceback
-            traceback.print_exc()
-
-            # Cleanup on error if we created a temp directory
-            if temp_dir and os.path.exists(temp_dir) and not output_dir:
-                try:
-                    shutil.rmtree(temp_dir)
-                    print(f"🗑️ Cleaned up temp directory after error: {temp_dir}")
-                except Exception as cleanup_error:
-                    print(f"⚠️ Cleanup error: {cleanup_error}")
+            # The pipeline already removed its temp directory
+            logger.error('convert failed', extra={'url': self.video_url}, exc_info=True)
 
             return {
                 'success': False,
@@ -121,10 +74,10 @@ class Video2Audio:
         if temp_dir and os.path.exists(temp_dir):
             try:
                 shutil.rmtree(temp_dir)
-                print(f"🗑️ Cleaned up: {temp_dir}")
+                logger.debug('temp directory removed', extra={'path': temp_dir})
                 return True
             except Exception as e:
-                print(f"⚠️ Cleanup error: {e}")
+                logger.warning('temp directory cleanup failed', extra={'path': temp_dir, 'error': str(e)})
                 return False
         return False
 
@@ -1,34 +1,97 @@
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .youtube_search import YouTubeSearcher
-from django.http import HttpResponse
-import os
-import tempfile
+from .youtube_search import SearchResult, YouTubeSearcher, extract_video_id, watch_url
+from .preview import build_preview, preview_limits, snap_start
+from .streaming import PipedTranscode
+from . import hls
+from .renderers import BinaryRenderer, FastJSONRenderer
+from .tracing import span
+from .profiling import list_profiles, profile_path
+from .pipeline import (
+    AnalysisStage, DownloadPipeline, PipelineJob, ServeStage, TimingHook, TrackCacheHook, default_stages,
+    get_job, pop_job
+)
+from .track_store import get_track_store
+from .waveform import MAX_RESOLUTION, META_SUFFIX, PEAKS_SUFFIX, select_level
+from .circuit_breaker import CircuitOpenError, breaker_states, get_breaker
+from .http_client import get_http_client, http_client_stats
+from .metadata import BulkResolver, remember
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+import hashlib
+import math
+import urllib.parse
 import logging
-import yt_dlp
-import shutil
+import os
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+
+def circuit_open_response(error):
+    """503 with Retry-After for calls rejected by an open circuit breaker"""
+    response = Response({'error': str(error), 'upstream': error.name}, status=503)
+    response['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+
+# Thumbnails are only proxied from YouTube's image hosts (i.ytimg.com, yt3.ggpht.com, ...)
+THUMBNAIL_HOST_SUFFIXES = ('ytimg.com', 'ggpht.com')
+
+
+def is_thumbnail_url(url):
+    """True for an http(s) URL on one of YouTube's image hosts, on the default port"""
+    try:
+        parsed = urllib.parse.urlsplit(url)
+        port = parsed.port
+    except ValueError:
+        return False
+    host = (parsed.hostname or '').lower()
+    if parsed.scheme not in ('http', 'https') or port is not None or parsed.username is not None:
+        return False
+    return any(host == suffix or host.endswith('.' + suffix) for suffix in THUMBNAIL_HOST_SUFFIXES)
+
+
+def _fetch_thumbnail(url, timeout=None):
+    response = get_http_client().get(url, timeout=timeout)
+    # 404 is a valid answer for a missing thumbnail, only 5xx means upstream trouble
+    if response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
 class YouTubeThumbnailView(APIView):
     """
     Proxy YouTube thumbnails through backend to avoid CORS issues
     """
     permission_classes = [AllowAny]
+    throttle_scope = 'thumbnail'
 
     def get(self, request, format=None):
         thumbnail_url = request.GET.get('url', '')
         if not thumbnail_url:
             return Response({'error': 'URL parameter required'}, status=400)
+        # Arbitrary hosts would let any client fail calls through the shared breaker
+        if not is_thumbnail_url(thumbnail_url):
+            return Response({'error': 'Only YouTube thumbnail URLs are proxied'}, status=400)
+
+        cache_key = 'youtube_thumbnail:' + hashlib.sha1(thumbnail_url.encode('utf-8')).hexdigest()
 
         try:
-            import requests
-            response = requests.get(thumbnail_url, timeout=10)
+            with span('network'):
+                response = get_breaker('youtube.thumbnail').call(_fetch_thumbnail, thumbnail_url)
             if response.status_code == 200:
+                cache.set(cache_key, response.content, 60 * 60 * 24)
                 return HttpResponse(response.content, content_type='image/jpeg')
             else:
                 return Response({'error': 'Failed to fetch thumbnail'}, status=404)
+        except CircuitOpenError as e:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return HttpResponse(cached, content_type='image/jpeg')
+            return circuit_open_response(e)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
@@ -36,8 +99,12 @@ class YouTubeThumbnailView(APIView):
 class YouTubeSearchView(APIView):
     """
     API endpoint to search YouTube videos
+    ?fields=id,title,... selects the returned fields, ?numeric_duration=1 returns duration_s in seconds
     """
     permission_classes = [AllowAny]
+    throttle_scope = 'search'
+
+    renderer_classes = [FastJSONRenderer]
 
     def get(self, request, format=None):
         query = request.GET.get('q', '')
@@ -46,131 +113,442 @@ class YouTubeSearchView(APIView):
         if not query:
             return Response({'error': 'Query parameter "q" is required'}, status=400)
 
+        fields = list(SearchResult.DEFAULT_FIELDS)
+        if request.GET.get('fields'):
+            fields = [field.strip() for field in request.GET['fields'].split(',') if field.strip()]
+            unknown = [field for field in fields if field not in SearchResult.FIELDS]
+            if unknown:
+                return Response({
+                    'error': f"Unknown field(s): {', '.join(unknown)}",
+                    'fields': SearchResult.FIELDS
+                }, status=400)
+        if _is_true(request.GET.get('numeric_duration')):
+            # Swap the preformatted string for raw seconds
+            fields = ['duration_s' if field == 'duration' else field for field in fields]
+        fields = tuple(dict.fromkeys(fields))
+
+        # Encoded payloads are cached per (query, max_results, fields) so repeat queries skip
+        # both the upstream search and serialization
+        digest = hashlib.sha1(f'{query.strip().lower()}|{max_results}|{",".join(fields)}'.encode('utf-8')).hexdigest()
+        cache_key = f'youtube_search_payload:{digest}'
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return Response(payload)
+
         try:
             searcher = YouTubeSearcher()
             videos = searcher.search(query, max_results=max_results)
-            return Response({'videos': videos})
+            remember(videos)
+            with span('serialization'):
+                payload = FastJSONRenderer.encode({'videos': [video.as_dict(fields) for video in videos]})
+            if videos:
+                cache.set(cache_key, payload, getattr(settings, 'SEARCH_RESPONSE_CACHE_TIMEOUT', 300))
+            return Response(payload)
+        except CircuitOpenError as e:
+            return circuit_open_response(e)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
 
 class YouTubeDownloadView(APIView):
     """
-    Download YouTube audio as MP3 using yt-dlp
+    Download YouTube audio as MP3 using the shared download pipeline
     File is temporarily downloaded, served to frontend, then immediately deleted
-    Supports both GET and POST methods
+    Supports both GET and POST methods; pass async=1 to run it as a background job,
+    or mode=pipe to stream bytes while the transcode is still running.
+    Only YouTube video URLs are accepted and yt-dlp always gets the canonical watch URL
     """
     permission_classes = [AllowAny]
+    throttle_scope = 'download'
 
     def get(self, request, format=None):
         """Handle GET requests with ?url= parameter"""
-        youtube_url = request.GET.get('url')
-        return self._download_audio(youtube_url)
+        return self._dispatch(request, request.GET.get('url'), request.GET.get('async'), request.GET.get('mode'))
 
     def post(self, request, format=None):
         """Handle POST requests with url in body"""
-        youtube_url = request.data.get('url')
+        return self._dispatch(
+            request,
+            request.data.get('url'),
+            request.data.get('async', request.GET.get('async')),
+            request.data.get('mode', request.GET.get('mode')),
+        )
+
+    def _dispatch(self, request, youtube_url, is_async, mode):
+        if not youtube_url:
+            return Response({'error': 'URL required'}, status=400)
+        video_id = extract_video_id(youtube_url) if isinstance(youtube_url, str) else None
+        if video_id is None:
+            return Response({'error': 'A YouTube video URL is required'}, status=400)
+        youtube_url = watch_url(video_id)
+        if _is_true(is_async):
+            return self._submit_job(request, youtube_url)
+        if mode == 'pipe':
+            return self._pipe_audio(youtube_url)
         return self._download_audio(youtube_url)
 
-    def _download_audio(self, youtube_url):
+    def _pipe_audio(self, youtube_url):
         """
-        Core download logic using yt-dlp
-        Downloads to temp directory, serves file, then cleans up immediately
+        Piped mode: relay MP3 bytes while yt-dlp and FFmpeg are still running
+        The first bytes go out after the first encoded frame; a finished transcode is
+        cached, so later requests for the same track are plain file responses
         """
-        if not youtube_url:
-            return Response({'error': 'URL required'}, status=400)
+        video_id = extract_video_id(youtube_url)
+        transcode = PipedTranscode(youtube_url, video_id)
+        filename = f'{video_id or "audio"}.mp3'
 
-        temp_dir = None
-        try:
-            logger.info(f"🔗 Starting download: {youtube_url}")
-
-            # Create temp directory for this download
-            temp_dir = tempfile.mkdtemp(prefix='youtube_dl_')
-            output_template = os.path.join(temp_dir, '%(title)s.%(ext)s')
-
-            # yt-dlp options - download best audio and convert to MP3
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': output_template,
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-            }
-
-            # Download video and extract metadata
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                logger.info("📝 Extracting video info...")
-                info = ydl.extract_info(youtube_url, download=True)
-                song_name = info.get('title', 'audio')
-
-                logger.info(f"📝 Title: {song_name}")
-
-            # Find the downloaded MP3 file in temp directory
-            downloaded_file = None
-            for file in os.listdir(temp_dir):
-                if file.endswith('.mp3'):
-                    downloaded_file = os.path.join(temp_dir, file)
-                    break
-
-            if not downloaded_file or not os.path.exists(downloaded_file):
-                raise Exception("Download completed but MP3 file not found")
-
-            file_size = os.path.getsize(downloaded_file)
-            logger.info(f"✓ Downloaded: {file_size} bytes ({file_size / 1024 / 1024:.2f} MB)")
-
-            if file_size == 0:
-                raise Exception("Downloaded file is empty")
-
-            # Read entire file into memory so we can delete it immediately
-            with open(downloaded_file, 'rb') as audio_file:
-                audio_data = audio_file.read()
-
-            logger.info(f"✓ File read into memory: {len(audio_data)} bytes")
-
-            # Clean up temp files BEFORE sending response
-            # This is safe because we have the data in memory
+        cached = transcode.cached_path()
+        if cached:
             try:
-                shutil.rmtree(temp_dir)
-                logger.info(f"🗑️ Cleaned up temp directory: {temp_dir}")
-                temp_dir = None  # Mark as cleaned
-            except Exception as cleanup_error:
-                logger.warning(f"⚠️ Cleanup error: {cleanup_error}")
-
-            # Create HTTP response with the audio data
-            response = HttpResponse(
-                audio_data,
-                content_type='audio/mpeg'
-            )
-
-            # Set headers for download
-            safe_filename = "".join(c for c in song_name if c.isalnum() or c in (' ', '-', '_'))[:50]
-            response['Content-Disposition'] = f'attachment; filename="{safe_filename}.mp3"'
-            response['Content-Length'] = len(audio_data)
-            response['Accept-Ranges'] = 'bytes'
-            response['Cache-Control'] = 'no-cache'
-
-            logger.info(f"✓ Response ready: {len(audio_data)} bytes ({len(audio_data) / 1024 / 1024:.2f} MB)")
-            logger.info(f"✓ Temporary files already cleaned up")
+                cached_file = open(cached, 'rb')
+            except FileNotFoundError:
+                # Evicted from the track store since the check, transcode it again
+                cached_file = None
+            if cached_file is not None:
+                logger.info('piped download cache hit', extra={'video_id': video_id})
+                return FileResponse(cached_file, content_type='audio/mpeg', as_attachment=True, filename=filename)
 
-            return response
+        try:
+            transcode.admit()
+        except CircuitOpenError as e:
+            return circuit_open_response(e)
+
+        logger.info('piped download started', extra={'url': youtube_url})
+        response = StreamingHttpResponse(transcode, content_type='audio/mpeg')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'no-cache'
+        # Ask reverse proxies not to buffer, otherwise TTFB is back to the full transcode
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _submit_job(self, request, youtube_url):
+        job = DownloadPipeline(stages=default_stages(serve=False)).submit(youtube_url)
+        logger.info('background download queued', extra={'job_id': job.id, 'url': youtube_url})
+        data = job.as_dict()
+        data['status_url'] = request.build_absolute_uri(reverse('youtube-download-job', args=[job.id]))
+        return Response(data, status=202)
+
+    def _download_audio(self, youtube_url):
+        """
+        Core download logic, runs the pipeline synchronously
+        The pipeline reads the file into memory and cleans up before the response is sent
+        """
+        try:
+            logger.info('download started', extra={'url': youtube_url})
+            ctx = DownloadPipeline(hooks=[TrackCacheHook(), TimingHook()]).run(youtube_url)
+            return ctx.response
+
+        except CircuitOpenError as e:
+            logger.warning('download rejected, circuit open', extra={'url': youtube_url, 'retry_after': e.retry_after})
+            return circuit_open_response(e)
 
         except Exception as e:
-            logger.error(f"✗ Download error: {str(e)}", exc_info=True)
+            logger.error('download failed', extra={'url': youtube_url}, exc_info=True)
             return Response({
                 'error': str(e),
                 'url': youtube_url
             }, status=500)
 
-        finally:
-            # Final cleanup in case something went wrong before the normal cleanup
-            if temp_dir and os.path.exists(temp_dir):
-                try:
-                    shutil.rmtree(temp_dir)
-                    logger.info(f"🗑️ Final cleanup of temp directory: {temp_dir}")
-                except Exception as cleanup_error:
-                    logger.error(f"Final cleanup error: {cleanup_error}")
+
+class DownloadJobView(APIView):
+    """
+    Status of a background download job
+    Once the job is done the audio is served and the job's files are removed
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'download_status'
+
+    def get(self, request, job_id, format=None):
+        job = get_job(job_id)
+        if job is None:
+            return Response({'error': 'Unknown or expired job'}, status=404)
+
+        if job.status == PipelineJob.DONE:
+            job = pop_job(job_id)
+            if job is None:
+                return Response({'error': 'Unknown or expired job'}, status=404)
+            try:
+                ServeStage().run(job.ctx)
+                return job.ctx.response
+            finally:
+                job.ctx.cleanup()
+
+        status = 500 if job.status == PipelineJob.FAILED else 202
+        if job.status == PipelineJob.FAILED:
+            pop_job(job_id)
+        return Response(job.as_dict(), status=status)
+
+
+def _is_true(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+class VideoResolveView(APIView):
+    """
+    Bulk metadata lookup for many tracks (POST {"ids": [<video ID or URL>, ...]})
+    Answers from the local metadata store first and extracts the rest concurrently;
+    results stream back as NDJSON, one line per track, in completion order.
+    Every ID that has to be extracted costs RATE_LIMIT['COSTS']['resolve_miss'] extra tokens
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'resolve'
+
+    def _resolver(self, request):
+        """BulkResolver for the request, None if the body isn't usable"""
+        if not hasattr(self, '_bulk_resolver'):
+            self._bulk_resolver = None
+            items = request.data.get('ids') if hasattr(request.data, 'get') else None
+            if isinstance(items, list) and 0 < len(items) <= getattr(settings, 'VIDEO_RESOLVE_MAX_IDS', 500):
+                self._bulk_resolver = BulkResolver(items, max_misses=getattr(settings, 'VIDEO_RESOLVE_MAX_MISSES', 50))
+        return self._bulk_resolver
+
+    def throttle_cost(self, request, cost):
+        resolver = self._resolver(request)
+        if resolver is None:
+            return cost
+        per_miss = getattr(settings, 'RATE_LIMIT', {}).get('COSTS', {}).get('resolve_miss', 1)
+        return cost + resolver.misses * per_miss
+
+    def post(self, request, format=None):
+        items = request.data.get('ids') if hasattr(request.data, 'get') else None
+        if not isinstance(items, list) or not items:
+            return Response({'error': '"ids" must be a non-empty list'}, status=400)
+        max_ids = getattr(settings, 'VIDEO_RESOLVE_MAX_IDS', 500)
+        if len(items) > max_ids:
+            return Response({'error': f'At most {max_ids} IDs per request'}, status=400)
+
+        response = StreamingHttpResponse(self._resolver(request), content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class PreviewView(APIView):
+    """
+    Short preview clip of a track (?url=&start=<seconds>&len=<seconds>)
+    Only the requested window is downloaded and transcoded; clips are cached per
+    (video ID, start, len) so repeated previews are served from disk. `start` is
+    snapped down to a PREVIEW_START_GRID_SECONDS grid (returned in X-Preview-Start)
+    so clients can't create unbounded cache entries by stepping it
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'preview'
+
+    def get(self, request, format=None):
+        youtube_url = request.GET.get('url', '')
+        min_len, max_len, default_len = preview_limits()
+        try:
+            start = float(request.GET.get('start', 0))
+            length = float(request.GET.get('len', default_len))
+            if not (math.isfinite(start) and math.isfinite(length)):
+                raise ValueError
+            length = int(length)
+        except (ValueError, OverflowError):
+            return Response({'error': '"start" and "len" must be finite numbers'}, status=400)
+
+        if not youtube_url:
+            return Response({'error': 'URL required'}, status=400)
+        # Anything else would go to yt-dlp's generic extractor through the shared breaker
+        video_id = extract_video_id(youtube_url)
+        if video_id is None:
+            return Response({'error': 'A YouTube video URL is required'}, status=400)
+        if not min_len <= length <= max_len:
+            return Response({'error': f'"len" must be between {min_len} and {max_len} seconds'}, status=400)
+        max_start = getattr(settings, 'PREVIEW_MAX_START_SECONDS', 6 * 60 * 60)
+        if start > max_start:
+            return Response({'error': f'"start" must be at most {max_start} seconds'}, status=400)
+        start = snap_start(start)
+
+        try:
+            ctx = build_preview(watch_url(video_id), video_id, start, length)
+            ctx.response['X-Preview-Start'] = str(start)
+            return ctx.response
+        except CircuitOpenError as e:
+            return circuit_open_response(e)
+        except Exception as e:
+            logger.error('preview failed', extra={'url': youtube_url}, exc_info=True)
+            return Response({'error': str(e), 'url': youtube_url}, status=500)
+
+
+class HLSStartView(APIView):
+    """
+    Start (or reuse) segmented HLS output for a track (?url=)
+    Returns the playlist URL straight away; playback can begin as soon as the first
+    segment is written instead of after the whole transcode
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'hls'
+
+    def get(self, request, format=None):
+        youtube_url = request.GET.get('url', '')
+        video_id = extract_video_id(youtube_url)
+        if not video_id:
+            return Response({'error': 'A YouTube video URL is required'}, status=400)
+
+        try:
+            status = hls.ensure_stream(watch_url(video_id), video_id)
+        except CircuitOpenError as e:
+            return circuit_open_response(e)
+        except Exception as e:
+            logger.error('hls start failed', extra={'url': youtube_url}, exc_info=True)
+            return Response({'error': str(e), 'url': youtube_url}, status=500)
+
+        return Response({
+            'id': video_id,
+            'status': status,
+            'playlist': request.build_absolute_uri(reverse('hls-playlist', args=[video_id])),
+        })
+
+
+class HLSPlaylistView(APIView):
+    """
+    Serve the HLS playlist, growing while the transcode is still running
+    Waits briefly for the first segment so a player can start right after HLSStartView
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'hls_segment'
+
+    def get(self, request, video_id, format=None):
+        if not get_track_store().is_valid_id(video_id):
+            return Response({'error': 'Invalid video ID'}, status=400)
+
+        playlist = hls.wait_for_playlist(video_id, getattr(settings, 'HLS_FIRST_SEGMENT_TIMEOUT', 20))
+        if playlist is None:
+            return Response({'error': 'No stream for this track, start it via /api/hls/?url='}, status=404)
+
+        get_track_store().touch(video_id, hls.HLS_SUFFIX)
+        response = HttpResponse(playlist, content_type='application/vnd.apple.mpegurl')
+        # An unfinished playlist changes with every segment, a finished one never does
+        response['Cache-Control'] = 'public, max-age=86400' if '#EXT-X-ENDLIST' in playlist else 'no-cache'
+        return response
+
+
+class HLSSegmentView(APIView):
+    """Serve one HLS segment; segments never change once written"""
+    permission_classes = [AllowAny]
+    throttle_scope = 'hls_segment'
+
+    def get(self, request, video_id, segment, format=None):
+        if not get_track_store().is_valid_id(video_id) or not hls.SEGMENT_RE.match(segment):
+            return Response({'error': 'Invalid segment'}, status=400)
+
+        path = os.path.join(hls.hls_dir(video_id), segment)
+        if not os.path.exists(path):
+            return Response({'error': 'Segment not found'}, status=404)
+
+        response = FileResponse(open(path, 'rb'), content_type='video/mp2t')
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+
+class AudioAnalysisView(APIView):
+    """
+    Stored loudness analysis for a track (?id=<video id>)
+    Populated by the download pipeline, so it's available once the track was downloaded
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'analysis'
+
+    def get(self, request, format=None):
+        video_id = request.GET.get('id', '')
+        store = get_track_store()
+        if not store.is_valid_id(video_id):
+            return Response({'error': 'Valid "id" parameter required'}, status=400)
+
+        analysis = store.read_json(video_id, AnalysisStage.suffix)
+        if analysis is None:
+            return Response({'error': 'No analysis for this track yet'}, status=404)
+        return Response({'id': video_id, **analysis})
+
+
+class WaveformView(APIView):
+    """
+    Precomputed waveform peaks for a track's scrub bar
+    ?id=<video id>&resolution=<bins>&format=json|bin
+    bin returns little-endian int16 [min, max] pairs, json returns the same values flattened
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'waveform'
+    renderer_classes = [FastJSONRenderer, BinaryRenderer]
+
+    def get(self, request, format=None):
+        video_id = request.GET.get('id', '')
+        store = get_track_store()
+        if not store.is_valid_id(video_id):
+            return Response({'error': 'Valid "id" parameter required'}, status=400)
+
+        try:
+            resolution = int(request.GET.get('resolution', 800))
+        except ValueError:
+            return Response({'error': '"resolution" must be an integer'}, status=400)
+        if not 1 <= resolution <= MAX_RESOLUTION:
+            return Response({'error': f'"resolution" must be between 1 and {MAX_RESOLUTION}'}, status=400)
+
+        meta = store.read_json(video_id, META_SUFFIX)
+        if meta is None or not store.exists(video_id, PEAKS_SUFFIX):
+            return Response({'error': 'No waveform for this track yet'}, status=404)
+
+        pyramid = np.load(store.path(video_id, PEAKS_SUFFIX), mmap_mode='r')
+        peaks, samples_per_bin = select_level(pyramid, meta['levels'], resolution)
+        seconds_per_bin = samples_per_bin / meta['sample_rate']
+
+        if request.accepted_renderer.format == 'bin':
+            response = Response(peaks.astype('<i2', copy=False).tobytes())
+            response['X-Waveform-Bins'] = str(len(peaks))
+            response['X-Waveform-Seconds-Per-Bin'] = f'{seconds_per_bin:.6f}'
+            response['Cache-Control'] = 'public, max-age=86400'
+            return response
+
+        response = Response({
+            'id': video_id,
+            'bins': len(peaks),
+            'seconds_per_bin': round(seconds_per_bin, 6),
+            'duration': meta['duration'],
+            'peaks': peaks.ravel().tolist(),
+        })
+        response['Cache-Control'] = 'public, max-age=86400'
+        return response
+
+
+class ProfileListView(APIView):
+    """
+    Stored request profiles (see ProfilingMiddleware), newest first
+    Admin only
+    """
+    permission_classes = [IsAdminUser]
+    throttle_scope = 'profiles'
+
+    def get(self, request, format=None):
+        profiles = list_profiles()
+        for profile in profiles:
+            profile['url'] = request.build_absolute_uri(reverse('profile-download', args=[profile['name']]))
+        return Response({'profiles': profiles})
+
+
+class ProfileDownloadView(APIView):
+    """
+    Download one stored profile
+    .prof files load with pstats/snakeviz, .folded files with flamegraph tools
+    """
+    permission_classes = [IsAdminUser]
+    throttle_scope = 'profiles'
+
+    def get(self, request, name, format=None):
+        path = profile_path(name)
+        if path is None:
+            return Response({'error': 'Profile not found'}, status=404)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
+
+
+class MetricsView(APIView):
+    """
+    Runtime metrics for monitoring upstream health
+    """
+    permission_classes = [AllowAny]
+    throttle_scope = 'metrics'
+
+    def get(self, request, format=None):
+        return Response({
+            'circuit_breakers': breaker_states(),
+            'http_client': http_client_stats(),
+        })
@@ -0,0 +1,86 @@
+import numpy as np
+
+# Mono samples (48 kHz) folded into each finest-level bin
+BASE_SAMPLES_PER_BIN = 256
+# Coarsest pyramid level kept; smaller requests are reduced from it
+MIN_LEVEL_BINS = 32
+MAX_RESOLUTION = 10000
+
+PEAKS_SUFFIX = '.peaks.npy'
+META_SUFFIX = '.waveform.json'
+
+
+class PeakAccumulator:
+    """
+    Min/max peaks of the mono mixdown, built from PCM chunks as they are decoded
+    Peaks are int16 so a whole track stays small and maps straight into a client waveform
+    """
+
+    def __init__(self, samples_per_bin=BASE_SAMPLES_PER_BIN):
+        self.samples_per_bin = samples_per_bin
+        self._remainder = np.empty(0, dtype=np.float32)
+        self._bins = []
+
+    def feed(self, pcm):
+        mono = pcm.mean(axis=1, dtype=np.float32) if pcm.ndim == 2 else pcm
+        data = np.concatenate((self._remainder, mono)) if len(self._remainder) else mono
+        usable = len(data) // self.samples_per_bin * self.samples_per_bin
+        self._remainder = data[usable:].copy()
+        if usable:
+            self._append(data[:usable].reshape(-1, self.samples_per_bin))
+
+    def _append(self, blocks):
+        self._bins.append(np.stack((blocks.min(axis=1), blocks.max(axis=1)), axis=1))
+
+    def result(self):
+        """(bins, 2) int16 array of [min, max] per bin"""
+        if len(self._remainder):
+            self._append(self._remainder.reshape(1, -1))
+            self._remainder = self._remainder[:0]
+        if not self._bins:
+            return np.zeros((0, 2), dtype=np.int16)
+        peaks = np.concatenate(self._bins)
+        return np.round(np.clip(peaks, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def build_pyramid(base):
+    """
+    Stack the base peaks with successively halved resolutions into one array
+    Returns (pyramid, levels) where levels is a list of (offset, bins, samples_per_bin)
+    """
+    levels = []
+    arrays = []
+    offset = 0
+    current = base
+    samples_per_bin = BASE_SAMPLES_PER_BIN
+    while True:
+        levels.append((offset, len(current), samples_per_bin))
+        arrays.append(current)
+        offset += len(current)
+        if len(current) <= MIN_LEVEL_BINS:
+            break
+        if len(current) % 2:
+            current = np.concatenate((current, current[-1:]))
+        pairs = current.reshape(-1, 2, 2)
+        current = np.stack((pairs[:, :, 0].min(axis=1), pairs[:, :, 1].max(axis=1)), axis=1)
+        samples_per_bin *= 2
+    return np.ascontiguousarray(np.concatenate(arrays)), levels
+
+
+def select_level(pyramid, levels, resolution):
+    """
+    Peaks for roughly `resolution` bins
+    Picks the coarsest level with at least `resolution` bins and returns it as a view of
+    the (memory-mapped) pyramid, so nothing is copied. Only when the level doesn't match
+    exactly are its at most 2x bins reduced down to the requested count.
+    Returns (peaks, samples_per_bin)
+    """
+    candidates = [level for level in levels if level[1] >= resolution]
+    offset, bins, samples_per_bin = candidates[-1] if candidates else levels[0]
+    view = pyramid[offset:offset + bins]
+    if bins <= resolution:
+        return view, samples_per_bin
+
+    edges = np.linspace(0, bins, resolution + 1).astype(np.intp)[:-1]
+    reduced = np.stack((np.minimum.reduceat(view[:, 0], edges), np.maximum.reduceat(view[:, 1], edges)), axis=1)
+    return reduced, samples_per_bin * bins / resolution
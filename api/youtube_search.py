@@ -1,146 +1,239 @@
+import hashlib
+import logging
+import re
+import urllib.parse
+
 import yt_dlp
-import requests
+from django.conf import settings
+from django.core.cache import cache
 
-class YouTubeSearcher:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .tracing import span
 
-    def search(self, query, max_results=10):
-        """Search YouTube using yt-dlp - most reliable method"""
+logger = logging.getLogger(__name__)
+
+
+_VIDEO_ID_PATTERNS = (
+    re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})'),
+    re.compile(r'^([A-Za-z0-9_-]{11})$'),
+)
+
+
+def extract_video_id(url):
+    """Video ID from a YouTube URL (or a bare ID), None if it isn't one"""
+    for pattern in _VIDEO_ID_PATTERNS:
+        match = pattern.search(url or '')
+        if match:
+            return match.group(1)
+    return None
+
+
+def watch_url(video_id):
+    """Canonical watch URL for a video ID, the only form handed to yt-dlp"""
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+def format_duration(seconds):
+    """Convert seconds to MM:SS or HH:MM:SS format"""
+    if not seconds or seconds == 0:
+        return '0:00'
+
+    try:
+        seconds = int(seconds)
+        hours = seconds // 3600
+        minutes = (seconds % 3600) // 60
+        secs = seconds % 60
+
+        if hours > 0:
+            return f'{hours}:{minutes:02d}:{secs:02d}'
+        else:
+            return f'{minutes}:{secs:02d}'
+    except:
+        return '0:00'
+
+
+class SearchResult:
+    """
+    One search hit, kept as the raw fields only
+    `url` and the formatted `duration` are derived when the result is serialized
+    """
+    __slots__ = ('id', 'title', 'thumbnail', 'channel', 'duration_s')
+
+    # Every field a client may request through ?fields=
+    FIELDS = ('id', 'title', 'thumbnail', 'channelName', 'duration', 'duration_s', 'url')
+    DEFAULT_FIELDS = ('id', 'title', 'thumbnail', 'channelName', 'duration', 'url')
+
+    def __init__(self, id, title, thumbnail, channel, duration_s):
+        self.id = id
+        self.title = title
+        self.thumbnail = thumbnail
+        self.channel = channel
+        self.duration_s = duration_s
+
+    @classmethod
+    def from_entry(cls, entry, default_channel='Unknown Channel'):
+        video_id = entry.get('id', '')
+        # If no thumbnail, construct default YouTube thumbnail URL
+        thumbnail = entry.get('thumbnail') or (f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg' if video_id else '')
         try:
-            print(f"Searching for: {query}")
-
-            # yt-dlp search options
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': True,  # Don't download, just get metadata
-                'force_generic_extractor': False,
-            }
-
-            # Search using yt-dlp
-            search_query = f"ytsearch{max_results}:{query}"
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                search_results = ydl.extract_info(search_query, download=False)
-
-                if not search_results or 'entries' not in search_results:
-                    print("No search results found")
-                    return []
-
-                videos = []
-                for entry in search_results['entries']:
-                    if not entry:
-                        continue
-
-                    try:
-                        video_id = entry.get('id', '')
-                        title = entry.get('title', 'Unknown Title')
-                        channel = entry.get('channel', entry.get('uploader', 'Unknown Channel'))
-                        duration = entry.get('duration', 0)
-                        thumbnail = entry.get('thumbnail', '')
-
-                        # If no thumbnail, construct default YouTube thumbnail URL
-                        if not thumbnail and video_id:
-                            thumbnail = f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg'
-
-                        video_data = {
-                            'id': video_id,
-                            'title': title,
-                            'thumbnail': thumbnail,
-                            'channelName': channel,
-                            'duration': self._format_duration(duration),
-                            'url': f'https://www.youtube.com/watch?v={video_id}'
-                        }
-
-                        videos.append(video_data)
-                        print(f"Found: {title} by {channel}")
-                        print(f"Thumbnail URL: {thumbnail}")
-
-                    except Exception as e:
-                        print(f"Error processing video entry: {str(e)}")
-                        continue
-
-                return videos
+            duration_s = int(entry.get('duration') or 0)
+        except (TypeError, ValueError):
+            duration_s = 0
+        return cls(
+            video_id,
+            entry.get('title', 'Unknown Title'),
+            thumbnail,
+            entry.get('channel', entry.get('uploader', default_channel)),
+            duration_s,
+        )
+
+    @property
+    def url(self):
+        return watch_url(self.id)
+
+    def get(self, field):
+        if field == 'channelName':
+            return self.channel
+        if field == 'duration':
+            return format_duration(self.duration_s)
+        return getattr(self, field)
+
+    def as_dict(self, fields=DEFAULT_FIELDS):
+        return {field: self.get(field) for field in fields}
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def __repr__(self):
+        return f'SearchResult(id={self.id!r}, title={self.title!r})'
+
 
+class YouTubeSearcher:
+    def search(self, query, max_results=10):
+        """
+        Search YouTube using yt-dlp - most reliable method
+        Returns a list of SearchResult records
+        Calls go through the 'youtube.search' circuit breaker; while it is open the last
+        cached results for the query are served instead of hitting YouTube again
+        """
+        cache_key = self._cache_key(query, max_results)
+        breaker = get_breaker('youtube.search')
+
+        try:
+            with span('extraction'):
+                videos = breaker.call(self._search, query, max_results)
+        except CircuitOpenError:
+            return self._cached_or_raise(cache_key)
         except Exception as e:
-            print(f"yt-dlp search error: {str(e)}")
-            # Fallback to alternative method if yt-dlp fails
-            return self._fallback_search(query, max_results)
+            logger.warning('search failed, trying fallback', extra={'error': str(e)})
+            # Only fall back while the breaker still lets calls through, otherwise
+            # we'd double the load on YouTube exactly when it's throttling us
+            try:
+                with span('extraction'):
+                    videos = breaker.call(self._fallback_search, query, max_results)
+            except CircuitOpenError:
+                return self._cached_or_raise(cache_key)
+            except Exception as fallback_error:
+                logger.warning('fallback search failed', extra={'error': str(fallback_error)})
+                cached = cache.get(cache_key)
+                return cached if cached is not None else []
+
+        if videos:
+            cache.set(cache_key, videos, getattr(settings, 'SEARCH_CACHE_TIMEOUT', 3600))
+        return videos
+
+    def _cache_key(self, query, max_results):
+        digest = hashlib.sha1(query.strip().lower().encode('utf-8')).hexdigest()
+        return f'youtube_search:{digest}:{max_results}'
+
+    def _cached_or_raise(self, cache_key):
+        """Fail fast with cached results while the breaker is open"""
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.info('circuit open, serving cached search results')
+            return cached
+        breaker = get_breaker('youtube.search')
+        raise CircuitOpenError(breaker.name, breaker.retry_after())
+
+    def _search(self, query, max_results=10, timeout=None):
+        """Primary search via the ytsearch pseudo-URL"""
+
+        # yt-dlp search options
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': True,  # Don't download, just get metadata
+            'force_generic_extractor': False,
+            'socket_timeout': timeout,
+        }
+
+        # Search using yt-dlp
+        search_query = f"ytsearch{max_results}:{query}"
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            search_results = ydl.extract_info(search_query, download=False)
+
+            if not search_results or 'entries' not in search_results:
+                logger.debug('no search results')
+                return []
+
+            videos = []
+            for entry in search_results['entries']:
+                if not entry:
+                    continue
+
+                try:
+                    videos.append(SearchResult.from_entry(entry))
+                except Exception as e:
+                    logger.debug('skipping malformed search entry', extra={'error': str(e)})
+                    continue
 
-    def _fallback_search(self, query, max_results=10):
+            return videos
+
+    def _fallback_search(self, query, max_results=10, timeout=None):
         """
         Fallback method using yt-dlp with direct YouTube search URL
         This is more reliable than web scraping
         """
-        try:
-            print("Using fallback search method...")
+        logger.info('using fallback search')
 
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': True,
-                'playlist_items': f'1-{max_results}',
-            }
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': True,
+            'playlist_items': f'1-{max_results}',
+            'socket_timeout': timeout,
+        }
 
-            # Direct YouTube search URL
-            search_url = f"https://www.youtube.com/results?search_query={requests.utils.quote(query)}"
+        # Direct YouTube search URL
+        search_url = f"https://www.youtube.com/results?search_query={urllib.parse.quote(query)}"
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                try:
-                    result = ydl.extract_info(search_url, download=False)
-
-                    if result and 'entries' in result:
-                        videos = []
-                        for entry in result['entries'][:max_results]:
-                            if not entry:
-                                continue
-
-                            video_id = entry.get('id', '')
-                            if not video_id:
-                                continue
-
-                            videos.append({
-                                'id': video_id,
-                                'title': entry.get('title', 'Unknown Title'),
-                                'thumbnail': entry.get('thumbnail', f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg'),
-                                'channelName': entry.get('channel', entry.get('uploader', 'Unknown')),
-                                'duration': self._format_duration(entry.get('duration', 0)),
-                                'url': f'https://www.youtube.com/watch?v={video_id}'
-                            })
-
-                        return videos
-                except:
-                    pass
-
-            # If all else fails, return empty list
-            print("All search methods failed")
-            return []
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            result = ydl.extract_info(search_url, download=False)
 
-        except Exception as e:
-            print(f"Fallback search error: {str(e)}")
-            return []
+            if not result or 'entries' not in result:
+                return []
 
-    def _format_duration(self, seconds):
-        """Convert seconds to MM:SS or HH:MM:SS format"""
-        if not seconds or seconds == 0:
-            return '0:00'
+            videos = []
+            for entry in result['entries'][:max_results]:
+                if not entry:
+                    continue
 
-        try:
-            seconds = int(seconds)
-            hours = seconds // 3600
-            minutes = (seconds % 3600) // 60
-            secs = seconds % 60
+                video_id = entry.get('id', '')
+                if not video_id:
+                    continue
 
-            if hours > 0:
-                return f'{hours}:{minutes:02d}:{secs:02d}'
-            else:
-                return f'{minutes}:{secs:02d}'
-        except:
-            return '0:00'
+                videos.append(SearchResult.from_entry(entry, default_channel='Unknown'))
+
+            return videos
+
+    def _format_duration(self, seconds):
+        """Convert seconds to MM:SS or HH:MM:SS format"""
+        return format_duration(seconds)
 
 
 # Example usage and testing
@@ -152,7 +245,7 @@ if __name__ == "__main__":
 
     print(f"\n✓ Found {len(results)} videos:")
     for i, video in enumerate(results, 1):
-        print(f"\n{i}. {video['title']}")
-        print(f"   Channel: {video['channelName']}")
-        print(f"   Duration: {video['duration']}")
-        print(f"   URL: {video['url']}")
+        print(f"\n{i}. {video.title}")
+        print(f"   Channel: {video.channel}")
+        print(f"   Duration: {video.get('duration')}")
+        print(f"   URL: {video.url}")
@@ -42,19 +42,171 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "api.tracing.TracingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api.profiling.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.RateLimitHeadersMiddleware",
 ]
 
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.AllowAny",
     ),
+    "DEFAULT_THROTTLE_CLASSES": (
+        "api.throttling.TokenBucketThrottle",
+    ),
+    # Reverse proxies in front of the app; rate limiting takes the client IP from
+    # X-Forwarded-For only this many hops deep (0 means REMOTE_ADDR, ignoring the header)
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 0)),
+}
+
+# Opt-in profiling of live requests (api/profiling.py). Disabled means the middleware is
+# dropped at startup. When enabled, SAMPLE_RATE of requests are profiled automatically and
+# staff users can add ?__profile=1 (cProfile) or ?__profile=sample (stack sampler) to any request.
+# Profiles are kept in DIR (newest MAX_FILES) and served at /api/profiles/
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED', 'False') == 'True',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 0.0)),
+    'MODE': 'cprofile',
+    'DIR': os.environ.get('PROFILING_DIR', '/tmp/api_profiles'),
+    'MAX_FILES': 50,
+    'SAMPLE_INTERVAL': 0.005,
+}
+
+# Per-client token bucket rate limiting (see api/throttling.py)
+# Buckets live in a SQLite file so every gunicorn worker shares them
+# Each request costs COSTS[view.throttle_scope] tokens; buckets hold CAPACITY tokens
+# and refill at REFILL_PER_SECOND. Benchmark with `python manage.py bench_ratelimit`
+RATE_LIMIT = {
+    'ENABLED': os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True',
+    'DB_PATH': os.environ.get('RATE_LIMIT_DB_PATH', '/tmp/ratelimit.sqlite3'),
+    'CAPACITY': 60,
+    'REFILL_PER_SECOND': 1.0,
+    # Clients presenting one of these X-API-Key values get a bucket of their own
+    'API_KEYS': frozenset(key for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if key),
+    'COSTS': {
+        'default': 1,
+        'search': 2,
+        'thumbnail': 0.5,
+        'download': 20,
+        'download_status': 0.25,
+        # Bulk resolve: a flat 'resolve' plus 'resolve_miss' per ID not in the metadata store
+        'resolve': 2,
+        'resolve_miss': 1,
+        'preview': 5,
+        'hls': 10,
+        'hls_segment': 0.1,
+        'analysis': 0.25,
+        'waveform': 0.25,
+        'metrics': 0,
+        'profiles': 0,
+    },
+}
+
+# Circuit breakers around upstream YouTube calls (see api/circuit_breaker.py)
+# Deadlines are derived from the observed latency percentile and clamped to [min_timeout, max_timeout]
+CIRCUIT_BREAKERS = {
+    'default': {
+        'failure_threshold': 5,
+        'recovery_timeout': 30.0,
+        'half_open_max_calls': 1,
+        'min_timeout': 5.0,
+        'max_timeout': 60.0,
+        'default_timeout': 20.0,
+    },
+    'youtube.thumbnail': {
+        'min_timeout': 2.0,
+        'max_timeout': 10.0,
+        'default_timeout': 10.0,
+    },
+    # Full downloads scale with track length, so give them much more room. The deadline only
+    # bounds single socket reads (yt-dlp's socket_timeout), so a long download that finishes
+    # is not a failure
+    'youtube.download': {
+        'min_timeout': 60.0,
+        'max_timeout': 900.0,
+        'default_timeout': 300.0,
+        'slow_call_is_failure': False,
+    },
+}
+
+# yt-dlp download tuning shared by YouTubeDownloadView and Video2Audio (see api/download_profile.py)
+# Benchmark concurrent_fragments against a local fixture with `python manage.py bench_download`
+DOWNLOAD_PROFILE = {
+    'concurrent_fragments': int(os.environ.get('DOWNLOAD_CONCURRENT_FRAGMENTS', 4)),
+    'http_chunk_size': 10 * 1024 * 1024,
+    'buffer_size': 64 * 1024,
+}
+
+# Background download jobs (api/pipeline.py): worker threads, how long finished jobs are kept,
+# where job state lives (shared by all worker processes) and how often expired jobs are swept
+DOWNLOAD_JOB_WORKERS = 2
+DOWNLOAD_JOB_TTL = 15 * 60
+DOWNLOAD_JOB_DIR = os.environ.get('DOWNLOAD_JOB_DIR', '/tmp/download_jobs')
+DOWNLOAD_JOB_SWEEP_INTERVAL = 60
+
+# Bulk metadata resolution (api/metadata.py): IDs per request, uncached IDs extracted per
+# request (the rest come back as 'deferred'), extraction threads shared by all requests,
+# and how long stored metadata is trusted
+VIDEO_RESOLVE_MAX_IDS = 500
+VIDEO_RESOLVE_MAX_MISSES = 50
+VIDEO_RESOLVE_WORKERS = 8
+VIDEO_METADATA_TTL = 7 * 24 * 60 * 60
+
+# Per-track artifacts such as loudness analysis and waveform peaks (api/track_store.py)
+TRACK_STORE_DIR = os.environ.get('TRACK_STORE_DIR', '/tmp/track_store')
+# Size cap for the track store (full tracks, HLS output, preview clips, analysis); least
+# recently used entries are evicted past it
+TRACK_STORE_MAX_BYTES = int(os.environ.get('TRACK_STORE_MAX_BYTES', 5 * 1024 ** 3))
+TRACK_STORE_EVICT_INTERVAL = 60
+
+# Compute loudness/peak/duration per track and return it as X-Loudness-*/X-ReplayGain-* headers
+# (inline for background jobs, after the response for synchronous downloads)
+AUDIO_ANALYSIS_ENABLED = os.environ.get('AUDIO_ANALYSIS_ENABLED', 'True') == 'True'
+
+# /api/preview/ clip length bounds in seconds
+PREVIEW_MIN_SECONDS = 5
+PREVIEW_MAX_SECONDS = 30
+PREVIEW_DEFAULT_SECONDS = 20
+# Latest allowed clip start, and the grid starts are snapped to (bounds distinct cached clips per track)
+PREVIEW_MAX_START_SECONDS = 6 * 60 * 60
+PREVIEW_START_GRID_SECONDS = 5
+
+# HLS output (api/hls.py): segment length and how long the playlist request waits for the first segment
+HLS_SEGMENT_SECONDS = 6
+HLS_FIRST_SEGMENT_TIMEOUT = 20
+
+# How long search results are kept for serving while the search breaker is open
+SEARCH_CACHE_TIMEOUT = 60 * 60
+
+# How long encoded /api/search/ payloads are reused for identical queries
+SEARCH_RESPONSE_CACHE_TIMEOUT = 5 * 60
+
+# Shared outbound HTTP client (api/http_client.py)
+# HOST_POOLS sizes the keep-alive pool per host suffix; HTTP2 needs the optional h2 package
+HTTP_CLIENT = {
+    'POOL_CONNECTIONS': 16,
+    'POOL_MAXSIZE': 10,
+    'HOST_POOLS': {
+        'i.ytimg.com': 32,
+        'youtube.com': 8,
+        'googlevideo.com': 16,
+    },
+    'POOL_BLOCK': False,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.3,
+    'RETRY_STATUSES': (429, 500, 502, 503, 504),
+    # Cap on the sleep between retries, even when the server sends a longer Retry-After
+    'RETRY_MAX_SLEEP': 2.0,
+    'DNS_CACHE_TTL': 300,
+    'DNS_CACHE_MAX_ENTRIES': 1024,
+    'HTTP2': os.environ.get('HTTP_CLIENT_HTTP2', 'False') == 'True',
 }
 
 ROOT_URLCONF = 'backend.urls'
@@ -124,12 +276,29 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'api.tracing.JSONFormatter',
+        },
+    },
+    'filters': {
+        'request_context': {
+            '()': 'api.tracing.RequestContextFilter',
+        },
+        'sampled': {
+            '()': 'api.tracing.SampledFilter',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
+        # Structured, sampled logs for the api app: INFO and below only for sampled requests
+        'structured': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            'filters': ['sampled', 'request_context'],
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -147,9 +316,21 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'api': {
+            'handlers': ['structured'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
+# Request tracing (api/tracing.py): every response gets X-Request-ID and a Server-Timing
+# breakdown; SAMPLE_RATE is the fraction of requests that get structured access/info logs
+TRACING = {
+    'SAMPLE_RATE': float(os.environ.get('TRACING_SAMPLE_RATE', 0.01)),
+    'SERVER_TIMING': True,
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -194,6 +375,24 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-api-key',
+    'x-request-id',
+]
+CORS_EXPOSE_HEADERS = [
+    'retry-after',
+    'x-ratelimit-limit',
+    'x-ratelimit-remaining',
+    'x-ratelimit-reset',
+    'x-ratelimit-cost',
+    'x-loudness-lufs',
+    'x-replaygain-track-gain',
+    'x-replaygain-track-peak',
+    'x-audio-duration',
+    'x-waveform-bins',
+    'x-waveform-seconds-per-bin',
+    'x-request-id',
+    'server-timing',
+    'x-profile-id',
 ]
 
 # Media files configuration